@@ -1,57 +1,94 @@
-import json
 import logging
 import configparser
-from logging.handlers import RotatingFileHandler
 from order.order import Order
+from order import pipeline
+from market.market import Market
+from accounts.context_cache import accountListCache, portfolioCache, balanceCache
+from accounts.allocation import allocate
+from accounts.position import Position
+from pagination import prefetched_pages, IncompletePages
+from api_response import decode, error_message
+import metrics
+import tracing
 import securities
-import string
-import random
 
 # loading configuration file
 config = configparser.ConfigParser()
 config.read('config.ini')
 
-# logger settings
+# logger, handlers are attached once by log_setup.setup_logging
 logger = logging.getLogger('my_logger')
-logger.setLevel(logging.DEBUG)
-handler = RotatingFileHandler(
-    "python_client.log", maxBytes=5 * 1024 * 1024, backupCount=3)
-FORMAT = "%(asctime)-15s %(message)s"
-fmt = logging.Formatter(FORMAT, datefmt='%m/%d/%Y %I:%M:%S %p')
-handler.setFormatter(fmt)
-logger.addHandler(handler)
 
 # portfolio configuration and contants
-devMode = devMode = False if config["DEFAULT"]["DEVMODE"] == "False" else True
 displayExtraOptions = False
-targetBondProportion = int(config["DEFAULT"]["TARGET_BOND_PCT"]) * (1/100)
-targetUSStockProportion = int(
-    config["DEFAULT"]["TARGET_US_STOCK_PCT"]) * (1/100)
-targetIntlStockProportion = int(
-    config["DEFAULT"]["TARGET_INTL_STOCK_PCT"]) * (1/100)
 
-# order ID to ensure only one order is placed per session
+
+def targetProportions(settings):
+    """
+    Reads the target weight of every category
+
+    TARGET_PCT lists them as "Bonds=20,US Stock=56,International Stock=24" and covers any category of the
+    securities table; without it TARGET_BOND_PCT, TARGET_US_STOCK_PCT and TARGET_INTL_STOCK_PCT set the three
+    default categories. Names are matched to the table ignoring case. Targets of unknown categories are dropped
+    and categories without a target are not rebalanced, both with a warning.
+
+    :param settings: config section
+    :return dict of target proportion keyed by category
+    """
+    if settings.get("TARGET_PCT"):
+        targets = {name.strip(): float(pct) for name, pct in
+                   (item.split("=", 1) for item in settings["TARGET_PCT"].split(",") if "=" in item)}
+    else:
+        targets = {securities.BONDS_CATEGORY: float(settings["TARGET_BOND_PCT"]),
+                   securities.US_STOCK_CATEGORY: float(settings["TARGET_US_STOCK_PCT"]),
+                   securities.INTL_STOCK_CATEGORY: float(settings["TARGET_INTL_STOCK_PCT"])}
+    known = {category.lower(): category for category in securities.CATEGORIES}
+    proportions = {}
+    for name, pct in targets.items():
+        category = known.get(name.lower())
+        if category is None:
+            logger.warning("Target category %r is not in the securities table, its target is ignored", name)
+        else:
+            proportions[category] = pct / 100
+    for category in securities.CATEGORIES:
+        if category not in proportions:
+            logger.warning("Category %r of the securities table has no target and is not rebalanced", category)
+    return proportions
+
+
+# categories of the securities table the targets were last read for, and the targets
+_targets = (None, {})
 
 
-def randomString(strlen):
-    letters = string.ascii_letters
-    return ''.join(random.choice(letters) for i in range(strlen))
+def currentTargetProportions():
+    """
+    Returns the target proportion of every category, read again when securities.reload changed the table
 
+    :return dict of target proportion keyed by category
+    """
+    global _targets
+    categories, proportions = _targets
+    if categories is not securities.CATEGORIES:
+        proportions = targetProportions(config["DEFAULT"])
+        _targets = (securities.CATEGORIES, proportions)
+    return proportions
 
-orderID = randomString(20)
+portfolioPageSize = config["DEFAULT"].getint("PORTFOLIO_PAGE_SIZE", fallback=50)
 
 
 class Accounts:
-    def __init__(self, session, base_url):
+    def __init__(self, session, base_url, verbose=True):
         """
         Initialize Accounts object with session and account information
 
         :param session: authenticated session
+        :param verbose: print API errors, otherwise they are only logged (e.g. in background fetches)
         """
         self.session = session
         self.account = {}
         self.holdingsDict = {}
         self.base_url = base_url
+        self.verbose = verbose
 
     def account_list(self):
         """
@@ -59,76 +96,89 @@ class Accounts:
 
         :param self:Passes in parameter authenticated session
         """
+        accounts = self.getAccounts()
+        if accounts is not None:
+            while True:
+                # Display account list
+                count = 1
+                print("\nBrokerage Account List:")
+                for account in accounts:
+                    print_str = str(count) + ")\t"
+                    if account is not None and "accountId" in account:
+                        print_str = print_str + (account["accountId"])
+                    if account is not None and "accountDesc" in account \
+                            and account["accountDesc"].strip() is not None:
+                        print_str = print_str + ", " + \
+                            account["accountDesc"].strip()
+                    if account is not None and "institutionType" in account:
+                        print_str = print_str + ", " + \
+                            account["institutionType"]
+                    print(print_str)
+                    count = count + 1
+                print(str(count) + ")\t" "Go Back")
+
+                # Select account option
+                account_index = input("Please select an account: ")
+                if account_index.isdigit() and 0 < int(account_index) < count:
+                    if self.base_url == "":
+                        self.account = accounts[int(account_index) - 1]
+                    else:
+                        self.account = accounts[int(account_index) - 1]
+                    self.holdingsDict = self.createHoldingsDict()
+                    self.account_menu()
+                elif account_index == str(count):
+                    break
+                else:
+                    print("Unknown Account Selected!")
+
+    @tracing.span("account_list")
+    def getAccounts(self):
+        """
+        Returns the user's E*TRADE accounts that are not closed, fetching them when older than ACCOUNT_LIST_CACHE_TTL
+
+        :param self:Passes in parameter authenticated session
+        :return list of account dicts, or None on error
+        """
+        data = accountListCache.get(self.base_url, self.fetchAccounts)
+        accounts = self.openAccounts(data)
+        if accounts is None:
+            # Handle errors, an error body must not be served from the cache
+            accountListCache.invalidate(self.base_url)
+            self.report(error_message(data, "AccountList API service error"))
+        return accounts
+
+    def fetchAccounts(self):
+        """
+        Calls account list API to retrieve the user's E*TRADE accounts
 
+        :param self:Passes in parameter authenticated session
+        :return parsed account list response, or the parsed error body (None if empty)
+        """
         # URL for the API endpoint
         url = self.base_url + "/v1/accounts/list.json"
 
         # Make API call for GET request
         response = self.session.get(url, header_auth=True)
-        logger.debug("Request Header: %s", response.request.headers)
 
         # Handle and parse response
-        if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(
-                parsed, indent=4, sort_keys=True))
-
-            data = response.json()
-            if data is not None and "AccountListResponse" in data and "Accounts" in data["AccountListResponse"] \
-                    and "Account" in data["AccountListResponse"]["Accounts"]:
-                accounts = data["AccountListResponse"]["Accounts"]["Account"]
-                while True:
-                    # Display account list
-                    count = 1
-                    print("\nBrokerage Account List:")
-                    accounts[:] = [d for d in accounts if d.get(
-                        'accountStatus') != 'CLOSED']
-                    for account in accounts:
-                        print_str = str(count) + ")\t"
-                        if account is not None and "accountId" in account:
-                            print_str = print_str + (account["accountId"])
-                        if account is not None and "accountDesc" in account \
-                                and account["accountDesc"].strip() is not None:
-                            print_str = print_str + ", " + \
-                                account["accountDesc"].strip()
-                        if account is not None and "institutionType" in account:
-                            print_str = print_str + ", " + \
-                                account["institutionType"]
-                        print(print_str)
-                        count = count + 1
-                    print(str(count) + ")\t" "Go Back")
-
-                    # Select account option
-                    account_index = input("Please select an account: ")
-                    if account_index.isdigit() and 0 < int(account_index) < count:
-                        if self.base_url == "":
-                            self.account = accounts[int(account_index) - 1]
-                        else:
-                            self.account = accounts[int(account_index) - 1]
-                        self.holdingsDict = self.createHoldingsDict()
-                        self.account_menu()
-                    elif account_index == str(count):
-                        break
-                    else:
-                        print("Unknown Account Selected!")
-            else:
-                # Handle errors
-                logger.debug("Response Body: %s", response.text)
-                if response is not None and response.headers['Content-Type'] == 'application/json' \
-                        and "Error" in response.json() and "message" in response.json()["Error"] \
-                        and response.json()["Error"]["message"] is not None:
-                    print("Error: " + data["Error"]["message"])
-                else:
-                    print("Error: AccountList API service error")
+        return decode(response)
+
+    @staticmethod
+    def openAccounts(data):
+        """
+        Returns the accounts of an account list response that are not closed, or None if data is not one
+        """
+        if data is not None and "AccountListResponse" in data and "Accounts" in data["AccountListResponse"] \
+                and "Account" in data["AccountListResponse"]["Accounts"]:
+            accounts = data["AccountListResponse"]["Accounts"]["Account"]
+            return [d for d in accounts if d.get('accountStatus') != 'CLOSED']
+        return None
+
+    def report(self, message):
+        if self.verbose:
+            print(message)
         else:
-            # Handle errors
-            logger.debug("Response Body: %s", response.text)
-            if response is not None and response.headers['Content-Type'] == 'application/json' \
-                    and "Error" in response.json() and "message" in response.json()["Error"] \
-                    and response.json()["Error"]["message"] is not None:
-                print("Error: " + response.json()["Error"]["message"])
-            else:
-                print("Error: AccountList API service error")
+            logger.debug(message)
 
     def portfolio(self):
         """
@@ -136,109 +186,116 @@ class Accounts:
 
         :param self: Passes in parameter authenticated session and information on selected account
         """
-        # URL for the API endpoint
-        url = self.base_url + "/v1/accounts/" + \
-            self.account["accountIdKey"] + "/portfolio.json"
-
-        # Make API call for GET request
-        response = self.session.get(url, header_auth=True)
-        logger.debug("Request Header: %s", response.request.headers)
-
         print("\nPortfolio:")
 
-        # Handle and parse response
-        if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(
-                parsed, indent=4, sort_keys=True))
-            if(devMode):
-                with open('fakeData.json') as f:
-                    data = json.load(f)
-            else:
-                data = response.json()
-            # TODO format output such that variables are of equal length (e.g variations amongst stock symbols does not make for uneven columns)
-            if data is not None and "PortfolioResponse" in data and "AccountPortfolio" in data["PortfolioResponse"]:
-                self.displayBalanceInfo(data)
-                uncategorizedHoldings = self.getUncategorizedHoldings(
-                    self.createStockDict(data))
-                if(len(uncategorizedHoldings) > 0):
-                    print("Uncategorized holdings:")
-                    print(uncategorizedHoldings)
-                else:
-                    print("No uncategorized holdings")
-            else:
-                # Handle errors
-                logger.debug("Response Body: %s", response.text)
-                if response is not None and "headers" in response and "Content-Type" in response.headers \
-                        and response.headers['Content-Type'] == 'application/json' \
-                        and "Error" in response.json() and "message" in response.json()["Error"] \
-                        and response.json()["Error"]["message"] is not None:
-                    print("Error: " + response.json()["Error"]["message"])
-                else:
-                    print("Error: Portfolio API service error")
-        elif response is not None and response.status_code == 204:
-            print("None")
-        else:
-            # Handle errors
-            logger.debug("Response Body: %s", response.text)
-            if response is not None and "headers" in response and "Content-Type" in response.headers \
-                    and response.headers['Content-Type'] == 'application/json' \
-                    and "Error" in response.json() and "message" in response.json()["Error"] \
-                    and response.json()["Error"]["message"] is not None:
-                print("Error: " + response.json()["Error"]["message"])
+        data = self.getPortfolio()
+        # TODO format output such that variables are of equal length (e.g variations amongst stock symbols does not make for uneven columns)
+        if data is not None:
+            self.displayBalanceInfo(data)
+            uncategorizedHoldings = self.getUncategorizedHoldings(
+                self.createStockDict(data))
+            if(len(uncategorizedHoldings) > 0):
+                print("Uncategorized holdings:")
+                print(uncategorizedHoldings)
             else:
-                print("Error: Portfolio API service error")
+                print("No uncategorized holdings")
 
+    @tracing.span("createHoldingsDict")
     def createHoldingsDict(self):
         """
-        Call portfolio API to retrieve a list of positions held in the specified account
+        Builds the holdings of the selected account from its portfolio snapshot
+
+        :param self: Passes in parameter authenticated session and information on selected account
+        :return dict of positions keyed by symbol, or None if the portfolio could not be retrieved
+        """
+        # the snapshot is cached, so the rebalance, the portfolio view and the purchase share one fetch
+        data = self.getPortfolio()
+        if data is not None:
+            return self.createStockDict(data)
+        return None
+
+    def getPortfolio(self):
+        """
+        Returns the portfolio snapshot of the selected account, fetching it when older than PORTFOLIO_CACHE_TTL
+
+        :param self: Passes in parameter authenticated session and information on selected account
+        :return parsed portfolio response or None
+        """
+        data = portfolioCache.get(self.account["accountIdKey"], self.fetchPortfolio)
+        logger.debug("Portfolio cache: %s", portfolioCache.stats())
+        return data
+
+    def fetchPortfolio(self):
+        """
+        Call portfolio API for every page of positions held in the specified account
+
+        :param self: Passes in parameter authenticated session and information on selected account
+        :return parsed portfolio response with the accounts of all pages merged, or None if any page failed
+        """
+        data = None
+        try:
+            for page in self.portfolioPages():
+                if data is None:
+                    # pages may be shared with concurrent callers through single flight, the merge goes into a copy
+                    data = {"PortfolioResponse": dict(page["PortfolioResponse"],
+                                                      AccountPortfolio=list(page["PortfolioResponse"]["AccountPortfolio"]))}
+                else:
+                    data["PortfolioResponse"]["AccountPortfolio"].extend(
+                        page["PortfolioResponse"]["AccountPortfolio"])
+        except IncompletePages as e:
+            # a partial portfolio must never be cached or rebalanced
+            self.report("Portfolio API service error: " + str(e))
+            return None
+        return data
+
+    def portfolioPages(self):
+        """
+        Yields the portfolio response page by page, prefetching the next page while the current one is processed
 
         :param self: Passes in parameter authenticated session and information on selected account
+        :return generator of parsed portfolio responses
+        """
+        return prefetched_pages(self.fetchPortfolioPage, 1)
+
+    def fetchPortfolioPage(self, pageNumber):
+        """
+        Call portfolio API to retrieve one page of positions held in the specified account
+
+        :param self: Passes in parameter authenticated session and information on selected account
+        :param pageNumber: page to retrieve, starting at 1
+        :return tuple of the parsed portfolio response (None on error) and the next page number (None on the last page)
         """
         # URL for the API endpoint
         url = self.base_url + "/v1/accounts/" + \
             self.account["accountIdKey"] + "/portfolio.json"
 
+        # Add parameters
+        params = {"count": portfolioPageSize, "pageNumber": pageNumber}
+
         # Make API call for GET request
-        response = self.session.get(url, header_auth=True)
-        logger.debug("Request Header: %s", response.request.headers)
+        response = self.session.get(url, header_auth=True, params=params)
 
         # Handle and parse response
+        data = decode(response)
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(
-                parsed, indent=4, sort_keys=True))
-            if(devMode):
-                with open('fakeData.json') as f:
-                    data = json.load(f)
-            else:
-                data = response.json()
-            # TODO format output such that variables are of equal length (e.g variations amongst stock symbols does not make for uneven columns)
             if data is not None and "PortfolioResponse" in data and "AccountPortfolio" in data["PortfolioResponse"]:
-                return self.createStockDict(data)
+                nextPage = None
+                for acctPortfolio in data["PortfolioResponse"]["AccountPortfolio"]:
+                    if acctPortfolio is not None and acctPortfolio.get("totalPages", 1) > pageNumber:
+                        nextPage = pageNumber + 1
+                return data, nextPage
             else:
                 # Handle errors
-                logger.debug("Response Body: %s", response.text)
-                if response is not None and "headers" in response and "Content-Type" in response.headers \
-                        and response.headers['Content-Type'] == 'application/json' \
-                        and "Error" in response.json() and "message" in response.json()["Error"] \
-                        and response.json()["Error"]["message"] is not None:
-                    print("Error: " + response.json()["Error"]["message"])
-                else:
-                    print("Error: Portfolio API service error")
+                self.report(error_message(data, "Portfolio API service error"))
         elif response is not None and response.status_code == 204:
-            print("None")
+            self.report("None")
         else:
             # Handle errors
-            logger.debug("Response Body: %s", response.text)
-            if response is not None and "headers" in response and "Content-Type" in response.headers \
-                    and response.headers['Content-Type'] == 'application/json' \
-                    and "Error" in response.json() and "message" in response.json()["Error"] \
-                    and response.json()["Error"]["message"] is not None:
-                print("Error: " + response.json()["Error"]["message"])
-            else:
-                print("Error: Portfolio API service error")
+            self.report(error_message(data, "Portfolio API service error"))
+        return None, None
 
+    @metrics.timed("render", "Accounts.displayBalanceInfo")
+    @tracing.span("render", function="Accounts.displayBalanceInfo")
     def displayBalanceInfo(self, data):
         for acctPortfolio in data["PortfolioResponse"]["AccountPortfolio"]:
             if acctPortfolio is not None and "Position" in acctPortfolio:
@@ -270,63 +327,68 @@ class Accounts:
                 print("None")
 
     def createPurchaseOrder(self, stockSymbol, value):
-        # TODO confirm that "EQ" is the correct order type and that DOLLAR quantity type gives expected results (e.g quantity = mktval / dollarQuantity)
-        order = {"PlaceOrderRequest": {
-            "orderType": "EQ", "clientOrderId": orderID,
-            "order": {
-                "priceType": "MARKET",
-                "orderTerm": "GOOD_FOR_DAY",
-                "marketSession": "REGULAR"
-            },
-            "Instrument": {
-                "Product": {
-                    "securityType": "EQ",
-                    "symbol": stockSymbol
-                },
-                "orderAction": "BUY",
-                "quantityType": "DOLLAR"
-            }
-        }
-        }
-        url = self.base_url + "/v1/accounts/" + \
-            self.account["accountIdKey"] + "/orders/preview"
-        # TODO try this with a live account to see if the error changes
-        response = self.session.post(url, data=order)
-        print(url)
-        print(response.text)
-        logger.debug("Request url: %s", url)
-        logger.debug("Request Header: %s", response.request.headers)
+        """
+        Previews and places a market order for the whole shares of stockSymbol that value dollars buy
 
-    def valueOfHoldings(self, stockList, holdings):
-        value = 0
-        for symbol in holdings:
-            if(symbol in stockList):
-                value += holdings[symbol]["marketValue"]
-        return value
+        :param self: Pass in parameters authenticated session and information on selected account
+        :param stockSymbol: symbol to buy
+        :param value: dollars to invest
+        :return PlannedOrder with the outcome, or None if the symbol has no quote or value buys no share
+        """
+        symbol = stockSymbol.strip().upper()
+        prices = Market.last_prices(Market(self.session, self.base_url).get_quotes([symbol]))
+        if not prices.get(symbol) or value < prices[symbol]:
+            print("Error: no quote for {} or {:,.2f} buys no share".format(symbol, value))
+            return None
+        order = pipeline.PlannedOrder(self.account["accountIdKey"], symbol, int(value // prices[symbol]),
+                                      prices[symbol], value)
+        pipeline.OrderPipeline(self.session, self.base_url).run([order])
+        pipeline.print_status([order])
+        return order
+
+    def purchase(self, amounts):
+        """
+        Buys whole shares of the weighted symbols of each category for the rebalance amounts, after confirmation
 
-    def getUncategorizedHoldings(self, holdings):
-        uncategorized = []
-        for symbol in holdings:
-            if(symbol not in securities.BONDS and symbol not in securities.INTL_STOCKS and symbol not in securities.US_STOCKS):
-                uncategorized.append(symbol)
-        return uncategorized
+        :param self: Pass in parameters authenticated session and information on selected account
+        :param amounts: dict of dollars keyed by category, as returned by Rebalancer.rebalance
+        """
+        weights = securities.purchase_weights()
+        symbols = [symbol for category in weights.values() for symbol in category]
+        prices = Market.last_prices(Market(self.session, self.base_url).get_quotes(symbols))
+        orders = pipeline.plan_orders(self.account["accountIdKey"], amounts, prices, weights)
+        if len(orders) == 0:
+            print("No whole share to buy")
+            return
+        pipeline.print_status(orders)
+        if input("Preview and place these orders? (y/n): ").strip().lower() == "y":
+            pipeline.OrderPipeline(self.session, self.base_url).run(orders)
+            pipeline.print_status(orders)
 
-    def calculateAdjustment(self, targestProportion, marketValue, totalPortfolioVal):
-        print("Current market value {}".format(marketValue))
-        return ((targestProportion * totalPortfolioVal) - marketValue) / (1 - targestProportion)
+    def getUncategorizedHoldings(self, holdings):
+        return securities.uncategorized(holdings)
 
+    @tracing.span("classify", function="Accounts.createStockDict")
     def createStockDict(self, data):
-        holdings = dict()
+        return self.createStockDictFromPositions(self.positionsInPage(data))
+
+    def createStockDictFromPositions(self, positions, holdings=None):
+        if holdings is None:
+            holdings = dict()
+        for position in positions:
+            if position is not None \
+                    and "symbolDescription" in position \
+                    and "pctOfPortfolio" in position \
+                    and "marketValue" in position \
+                    and "totalGain" in position:
+                holdings[position["symbolDescription"]] = Position.fromResponse(position)
+        return holdings
+
+    @staticmethod
+    def positionsInPage(data):
         for portfolio in data["PortfolioResponse"]["AccountPortfolio"]:
             if portfolio is not None and "Position" in portfolio:
-                for position in portfolio["Position"]:
-                    if position is not None \
-                            and "symbolDescription" in position \
-                            and "pctOfPortfolio" in position \
-                            and "marketValue" in position \
-                            and "totalGain" in position:
-                        holdings[position["symbolDescription"]] = position
-        return holdings
+                yield from portfolio["Position"]
 
     def balance(self):
         """
@@ -334,7 +396,53 @@ class Accounts:
 
         :param self: Pass in parameters authenticated session and information on selected account
         """
+        data = self.getBalance()
+        if data is not None and "BalanceResponse" in data:
+            balance_data = data["BalanceResponse"]
+            if balance_data is not None and "accountId" in balance_data:
+                print("\n\nBalance for " + balance_data["accountId"] + ":")
+            else:
+                print("\n\nBalance:")
+            # Display balance information
+            if balance_data is not None and "accountDescription" in balance_data:
+                print("Account Nickname: " +
+                      balance_data["accountDescription"])
+            if balance_data is not None and "Computed" in balance_data \
+                    and "RealTimeValues" in balance_data["Computed"] \
+                    and "totalAccountValue" in balance_data["Computed"]["RealTimeValues"]:
+                print("Net Account Value: "
+                      + str('${:,.2f}'.format(balance_data["Computed"]["RealTimeValues"]["totalAccountValue"])))
+            if balance_data is not None and "Computed" in balance_data \
+                    and "marginBuyingPower" in balance_data["Computed"]:
+                print("Margin Buying Power: " +
+                      str('${:,.2f}'.format(balance_data["Computed"]["marginBuyingPower"])))
+            if balance_data is not None and "Computed" in balance_data \
+                    and "cashBuyingPower" in balance_data["Computed"]:
+                print("Cash Buying Power: " +
+                      str('${:,.2f}'.format(balance_data["Computed"]["cashBuyingPower"])))
+        else:
+            # Handle errors
+            print(error_message(data, "Balance API service error"))
+
+    def getBalance(self):
+        """
+        Returns the balance of the selected account, fetching it when older than BALANCE_CACHE_TTL
+
+        :param self: Pass in parameters authenticated session and information on selected account
+        :return parsed balance response, or the parsed error body (None if empty)
+        """
+        data = balanceCache.get(self.account["accountIdKey"], self.fetchBalance)
+        if data is None or "BalanceResponse" not in data:
+            balanceCache.invalidate(self.account["accountIdKey"])
+        return data
+
+    def fetchBalance(self):
+        """
+        Calls account balance API for the selected account
 
+        :param self: Pass in parameters authenticated session and information on selected account
+        :return parsed balance response, or the parsed error body (None if empty)
+        """
         # URL for the API endpoint
         url = self.base_url + "/v1/accounts/" + \
             self.account["accountIdKey"] + "/balance.json"
@@ -348,55 +456,9 @@ class Accounts:
         response = self.session.get(
             url, header_auth=True, params=params, headers=headers)
         logger.debug("Request url: %s", url)
-        logger.debug("Request Header: %s", response.request.headers)
 
-        # Handle and parse response
-        if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(
-                parsed, indent=4, sort_keys=True))
-            data = response.json()
-            if data is not None and "BalanceResponse" in data:
-                balance_data = data["BalanceResponse"]
-                if balance_data is not None and "accountId" in balance_data:
-                    print("\n\nBalance for " + balance_data["accountId"] + ":")
-                else:
-                    print("\n\nBalance:")
-                # Display balance information
-                if balance_data is not None and "accountDescription" in balance_data:
-                    print("Account Nickname: " +
-                          balance_data["accountDescription"])
-                if balance_data is not None and "Computed" in balance_data \
-                        and "RealTimeValues" in balance_data["Computed"] \
-                        and "totalAccountValue" in balance_data["Computed"]["RealTimeValues"]:
-                    print("Net Account Value: "
-                          + str('${:,.2f}'.format(balance_data["Computed"]["RealTimeValues"]["totalAccountValue"])))
-                if balance_data is not None and "Computed" in balance_data \
-                        and "marginBuyingPower" in balance_data["Computed"]:
-                    print("Margin Buying Power: " +
-                          str('${:,.2f}'.format(balance_data["Computed"]["marginBuyingPower"])))
-                if balance_data is not None and "Computed" in balance_data \
-                        and "cashBuyingPower" in balance_data["Computed"]:
-                    print("Cash Buying Power: " +
-                          str('${:,.2f}'.format(balance_data["Computed"]["cashBuyingPower"])))
-            else:
-                # Handle errors
-                logger.debug("Response Body: %s", response.text)
-                if response is not None and response.headers['Content-Type'] == 'application/json' \
-                        and "Error" in response.json() and "message" in response.json()["Error"] \
-                        and response.json()["Error"]["message"] is not None:
-                    print("Error: " + response.json()["Error"]["message"])
-                else:
-                    print("Error: Balance API service error")
-        else:
-            # Handle errors
-            logger.debug("Response Body: %s", response.text)
-            if response is not None and response.headers['Content-Type'] == 'application/json' \
-                    and "Error" in response.json() and "message" in response.json()["Error"] \
-                    and response.json()["Error"]["message"] is not None:
-                print("Error: " + response.json()["Error"]["message"])
-            else:
-                print("Error: Balance API service error")
+        # Handle and parse response, an error body carries the message shown to the user
+        return decode(response)
 
     def account_menu(self):
         """
@@ -427,9 +489,13 @@ class Accounts:
                     order = Order(self.session, self.account, self.base_url)
                     order.view_orders()
                 elif selection == "5":
+                    # refresh holdings captured at selection time if the snapshot has expired
+                    self.holdingsDict = self.createHoldingsDict()
                     rebalancer = Rebalancer(
                         self.holdingsDict)
-                    print(rebalancer.rebalance())
+                    amounts = rebalancer.rebalance()
+                    print(amounts)
+                    self.purchase(amounts)
                 elif selection == "6":
                     break
                 else:
@@ -467,78 +533,59 @@ class Accounts:
                     print("Unknown Option Selected!")
 
 
+def percentOf(value, total):
+    # an empty account has no distribution, every category is shown at 0%
+    return value * 100 / total if total else 0
+
+
 class Rebalancer:
-    def __init__(self, holdingsDict):
+    def __init__(self, holdingsDict, verbose=True):
         self.holdingsDict = holdingsDict
+        self.verbose = verbose
 
+    @tracing.span("classify", function="Rebalancer.currentDistribution")
+    def currentDistribution(self):
+        totals = securities.category_totals(self.holdingsDict)
+        return {assetClass: totals.get(assetClass, 0) for assetClass in currentTargetProportions()}
+
+    @tracing.span("rebalance")
     def rebalance(self):
-        holdings = self.holdingsDict
-        currentDist = {"Bonds": self.valueOfHoldings(securities.BONDS, holdings), "US Stock": self.valueOfHoldings(
-            securities.US_STOCKS, holdings), "International Stock": self.valueOfHoldings(securities.INTL_STOCKS, holdings)}
-        amts = {"Bonds": 0, "US Stock": 0, "International Stock": 0}
-        portfolioVal = 0
-        for securityType in currentDist:
-            portfolioVal += currentDist[securityType]
-        print("-------------------------------")
-        print("Current distribution")
-        for securityType in currentDist:
-            print("{}: {:.3f}%".format(securityType,
-                                       currentDist[securityType] * 100 / portfolioVal))
-        print("Total value of holdings: {:,.2f}".format(portfolioVal))
-        result = self.rebalanceUtil(amts, currentDist, int(
-            config["DEFAULT"]["MONTHLY_PURCHASE_VAL"]))
-        print("Distribution after adjustment")
-        for securityType in result:
-            portfolioVal += result[securityType]
-        for securityType in currentDist:
-            print("{}: {:.3f}%".format(securityType,
-                                       (currentDist[securityType] + result[securityType]) * 100 / portfolioVal))
+        currentDist = self.currentDistribution()
+        result = self.purchaseAmounts([currentDist])[0]
+        if self.verbose:
+            portfolioVal = sum(currentDist.values())
+            print("-------------------------------")
+            print("Current distribution")
+            for securityType in currentDist:
+                print("{}: {:.3f}%".format(securityType,
+                                           percentOf(currentDist[securityType], portfolioVal)))
+            print("Total value of holdings: {:,.2f}".format(portfolioVal))
+            print("Distribution after adjustment")
+            portfolioVal += sum(result.values())
+            for securityType in currentDist:
+                print("{}: {:.3f}%".format(securityType,
+                                           percentOf(currentDist[securityType] + result[securityType], portfolioVal)))
         return result
 
-    def rebalanceUtil(self, amts, currentDist, remaining):
-        portfolioVal = 0
-        for securityType in currentDist:
-            portfolioVal += currentDist[securityType]
-        if(currentDist["Bonds"] / portfolioVal < targetBondProportion):
-            adjustment = self.calculateAdjustment(
-                targetBondProportion, currentDist["Bonds"], portfolioVal)
-            amts["Bonds"] += adjustment
-        elif(currentDist["US Stock"] / targetUSStockProportion < currentDist["International Stock"] / targetIntlStockProportion):
-            adjustment = self.calculateAdjustment(
-                targetUSStockProportion, currentDist["US Stock"], portfolioVal)
-            amts["US Stock"] += adjustment
-        elif(currentDist["International Stock"] / targetIntlStockProportion < currentDist["US Stock"] / targetUSStockProportion):
-            adjustment = self.calculateAdjustment(
-                targetIntlStockProportion, currentDist["International Stock"], portfolioVal)
-            amts["International Stock"] += adjustment
-            currentDist["International Stock"] += adjustment
-        else:
-            amts["Bonds"] += targetBondProportion * remaining
-            currentDist["Bonds"] += adjustment
-            amts["US Stock"] += targetUSStockProportion * remaining
-            currentDist["US Stock"] += adjustment
-            amts["International Stock"] += targetIntlStockProportion * remaining
-            currentDist["International Stock"] += adjustment
-            adjustment = remaining
-        remainder = remaining - adjustment
-        if(remainder > 0):
-            return self.rebalanceUtil(amts, currentDist, remainder)
-        else:
-            return amts
-
-    def valueOfHoldings(self, stockList, holdings):
-        value = 0
-        for symbol in holdings:
-            if(symbol in stockList):
-                value += holdings[symbol]["marketValue"]
-        return value
+    @classmethod
+    @tracing.span("rebalance", accounts="many")
+    def rebalanceAccounts(cls, holdingsDicts):
+        """
+        Computes the purchase of the monthly contribution for many accounts in a single allocation
 
-    def getUncategorizedHoldings(self, holdings):
-        uncategorized = []
-        for symbol in holdings:
-            if(symbol not in securities.BONDS and symbol not in securities.INTL_STOCKS and symbol not in securities.US_STOCKS):
-                uncategorized.append(symbol)
-        return uncategorized
-
-    def calculateAdjustment(self, targetProportion, currentHoldings, currentPortfolioVal):
-        return ((targetProportion * currentPortfolioVal) - currentHoldings) / (1 - targetProportion)
+        :param holdingsDicts: list of holdings dicts, one per account
+        :return list of purchase amounts keyed by asset class, in the order of holdingsDicts
+        """
+        return cls.purchaseAmounts([cls(holdings, verbose=False).currentDistribution() for holdings in holdingsDicts])
+
+    @staticmethod
+    def purchaseAmounts(distributions):
+        if len(distributions) == 0:
+            return []
+        targets = currentTargetProportions()
+        classes = list(targets)
+        amounts = allocate([[distribution.get(assetClass, 0) for assetClass in classes]
+                            for distribution in distributions],
+                           [targets[assetClass] for assetClass in classes],
+                           int(config["DEFAULT"]["MONTHLY_PURCHASE_VAL"]))
+        return [dict(zip(classes, row.tolist())) for row in amounts]
@@ -0,0 +1,195 @@
+import heapq
+import math
+import numpy as np
+
+
+def allocate(values, targets, contributions):
+    """
+    Splits new money across asset classes so the portfolio ends as close to the target weights as possible
+
+    Money goes to the most underweight classes first, filling them up to a common value / target ratio.
+    The level is found in closed form from the cumulative sums of the classes sorted by that ratio, so
+    small contributions (only the most underweight classes are topped up) and large ones (every class
+    reaches its target) are handled by the same computation, for many accounts at once.
+
+    :param values: current value of each asset class, shape (classes,) or (accounts, classes)
+    :param targets: target weight of each asset class, shape (classes,) or (accounts, classes)
+    :param contributions: new money to invest, scalar or shape (accounts,)
+    :return amount to buy of each asset class, with the shape of values
+    """
+    values = np.asarray(values, dtype=float)
+    single = values.ndim == 1
+    values = np.atleast_2d(values)
+    if values.shape[1] == 0:
+        # no asset class to buy
+        return np.zeros(values.shape)[0] if single else np.zeros(values.shape)
+    targets = np.broadcast_to(np.asarray(targets, dtype=float), values.shape)
+    contributions = np.broadcast_to(np.asarray(contributions, dtype=float), values.shape[:1])
+
+    # classes without a target weight never receive money
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratios = np.where(targets > 0, values / targets, np.inf)
+    order = np.argsort(ratios, axis=1)
+    sortedRatios = np.take_along_axis(ratios, order, axis=1)
+    sortedValues = np.take_along_axis(values, order, axis=1)
+    sortedTargets = np.take_along_axis(targets, order, axis=1)
+
+    # level reached when the k most underweight classes share the contribution, the classes that
+    # receive money are the prefix whose own ratio is still below that level
+    with np.errstate(divide="ignore", invalid="ignore"):
+        levels = (contributions[:, None] + np.cumsum(sortedValues, axis=1)) / np.cumsum(sortedTargets, axis=1)
+    funded = (levels > sortedRatios).sum(axis=1)
+    level = np.take_along_axis(levels, np.maximum(funded - 1, 0)[:, None], axis=1)
+
+    # without any target the level is infinite, those accounts are masked out by funded
+    with np.errstate(invalid="ignore"):
+        amounts = np.where(funded[:, None] > 0, np.clip(targets * level - values, 0, None), 0.0)
+    return amounts[0] if single else amounts
+
+
+def whole_shares(targets, prices, spendLeftover=True, candidates=8, exactLimit=50000):
+    """
+    Converts dollar targets per symbol into whole share counts that stay within the total of the targets
+
+    Every symbol starts at the shares its target fully pays for. Extra shares then go, one at a time, to the
+    symbol whose next share reduces the squared dollar drift from the targets the most, taken from a heap keyed
+    by that change; only the symbol that was bought needs a new key. When no affordable share reduces the drift,
+    a share that does is bought by selling as few shares of another symbol as needed, trying the best
+    candidates of both sides, until no such exchange helps. The drift found this way bounds the shares of every
+    symbol in an optimal answer; when those bounds leave few enough combinations they are searched exhaustively,
+    so small problems get the least drift possible. With spendLeftover, the cash still left then buys the shares
+    that increase the drift the least, until it is below every price.
+
+    :param targets: dict of dollars keyed by symbol
+    :param prices: dict of share prices keyed by symbol, symbols without a positive price are not bought
+    :param spendLeftover: trade drift for cash left over, as long as a share is affordable
+    :param candidates: symbols tried on each side of an exchange
+    :param exactLimit: largest number of share combinations searched exhaustively
+    :return tuple of the dict of shares keyed by symbol and the leftover cash
+    """
+    shares = {}
+    drifts = {}
+    leftover = 0.0
+    for symbol, target in targets.items():
+        price = prices.get(symbol)
+        if not price or price <= 0 or target <= 0:
+            continue
+        shares[symbol] = int(target // price)
+        drifts[symbol] = shares[symbol] * price - target
+        leftover += target - shares[symbol] * price
+
+    def change(symbol, count):
+        # change of the squared drift when buying count more shares (selling if negative)
+        drift = drifts[symbol]
+        return (drift + count * prices[symbol]) ** 2 - drift ** 2
+
+    def buy(symbol, count):
+        nonlocal leftover
+        shares[symbol] += count
+        drifts[symbol] += count * prices[symbol]
+        leftover -= count * prices[symbol]
+
+    def fill(spend):
+        heap = [(change(symbol, 1), symbol) for symbol in drifts]
+        heapq.heapify(heap)
+        while heap:
+            increase, symbol = heap[0]
+            if prices[symbol] > leftover + 1e-9:
+                # leftover cash only shrinks, the symbol never becomes affordable again
+                heapq.heappop(heap)
+                continue
+            if increase >= 0 and not spend:
+                break
+            buy(symbol, 1)
+            heapq.heapreplace(heap, (change(symbol, 1), symbol))
+
+    fill(False)
+    # every exchange lowers the drift, so the loop ends; the bound only guards against float noise
+    for _ in range(10 * len(drifts)):
+        best = (-1e-9, None, None, 0)
+        bought = heapq.nsmallest(candidates, drifts, key=lambda symbol: change(symbol, 1))
+        sold = heapq.nsmallest(candidates, [symbol for symbol in drifts if shares[symbol] > 0],
+                               key=lambda symbol: change(symbol, -1))
+        for symbol in bought:
+            for other in sold:
+                if other == symbol:
+                    continue
+                count = max(math.ceil((prices[symbol] - leftover - 1e-9) / prices[other]), 1)
+                if count > shares[other]:
+                    continue
+                gain = change(symbol, 1) + change(other, -count)
+                if gain < best[0]:
+                    best = (gain, symbol, other, count)
+        if best[1] is None:
+            break
+        buy(best[2], -best[3])
+        buy(best[1], 1)
+        fill(False)
+    budget = leftover + sum(shares[symbol] * prices[symbol] for symbol in shares)
+    optimal = exact_shares(targets, prices, shares, budget, sum(drift ** 2 for drift in drifts.values()), exactLimit)
+    if optimal is not None:
+        for symbol, count in optimal.items():
+            buy(symbol, count - shares[symbol])
+    if spendLeftover:
+        fill(True)
+    return shares, max(leftover, 0.0)
+
+
+def exact_shares(targets, prices, shares, budget, bound, limit):
+    """
+    Searches the share counts whose squared drift is below bound for the one with the least drift
+
+    A squared drift below bound keeps every symbol within sqrt(bound) dollars of its target, which bounds its
+    share count. The combinations are searched depth first, pruned by budget and by the least drift the
+    remaining symbols can still add.
+
+    :param shares: dict of share counts keyed by symbol, the symbols searched
+    :param budget: dollars the shares may cost at most
+    :param bound: squared drift of the best known answer
+    :param limit: largest number of combinations to search
+    :return dict of shares keyed by symbol with less drift than bound, or None if there is none or the search
+            would exceed limit
+    """
+    if len(shares) > 100:
+        # one level of recursion per symbol
+        return None
+    radius = math.sqrt(bound) + 1e-9
+    symbols = []
+    size = 1
+    for symbol in shares:
+        price, target = prices[symbol], targets[symbol]
+        low = max(math.ceil((target - radius) / price), 0)
+        high = math.floor((target + radius) / price)
+        if high < low:
+            return None
+        symbols.append((symbol, price, target, low, high))
+        size *= high - low + 1
+        if size > limit:
+            return None
+    symbols.sort(key=lambda entry: entry[4] - entry[3])
+
+    # least drift and least cost the symbols from index on can still add
+    leastDrift = [0.0] * (len(symbols) + 1)
+    leastCost = [0.0] * (len(symbols) + 1)
+    for index in range(len(symbols) - 1, -1, -1):
+        symbol, price, target, low, high = symbols[index]
+        nearest = min(max(round(target / price), low), high)
+        leastDrift[index] = leastDrift[index + 1] + (nearest * price - target) ** 2
+        leastCost[index] = leastCost[index + 1] + low * price
+
+    best = [bound - 1e-6, None]
+    counts = {}
+
+    def search(index, drift, cost):
+        if drift + leastDrift[index] >= best[0] or cost + leastCost[index] > budget + 1e-9:
+            return
+        if index == len(symbols):
+            best[0], best[1] = drift, dict(counts)
+            return
+        symbol, price, target, low, high = symbols[index]
+        for count in range(low, high + 1):
+            counts[symbol] = count
+            search(index + 1, drift + (count * price - target) ** 2, cost + count * price)
+
+    search(0, 0.0, 0.0)
+    return best[1]
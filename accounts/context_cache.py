@@ -0,0 +1,15 @@
+"""Account context shared by the menus, the rebalancer and the background prefetcher"""
+import configparser
+from accounts.portfolio_cache import PortfolioCache
+
+# loading configuration file
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# account list keyed by base url
+accountListCache = PortfolioCache(config["DEFAULT"].getfloat("ACCOUNT_LIST_CACHE_TTL", fallback=300))
+# portfolio snapshots shared by Portfolio, Rebalance and the uncategorized holdings check
+portfolioCache = PortfolioCache(config["DEFAULT"].getfloat("PORTFOLIO_CACHE_TTL", fallback=60))
+balanceCache = PortfolioCache(config["DEFAULT"].getfloat("BALANCE_CACHE_TTL", fallback=60))
+# first page of orders responses keyed by (accountIdKey, status)
+ordersCache = PortfolioCache(config["DEFAULT"].getfloat("ORDERS_CACHE_TTL", fallback=30))
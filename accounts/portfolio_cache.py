@@ -0,0 +1,89 @@
+import threading
+import time
+
+
+class PortfolioCache:
+    def __init__(self, ttl):
+        """
+        Initialize a cache of API response snapshots (portfolio.json by default) keyed by account
+
+        :param ttl: seconds a snapshot may be served before it is fetched again
+        """
+        self.ttl = ttl
+        self.snapshots = {}
+        # bumped by invalidate, a fetch started before an invalidation must not store its older result
+        self.epoch = 0
+        self.generations = {}
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, accountIdKey, fetch):
+        """
+        Returns the snapshot for an account, calling fetch() when it is missing or older than the TTL
+
+        :param accountIdKey: account the snapshot belongs to
+        :param fetch: callable returning the parsed portfolio response, or None on error
+        :return parsed portfolio response or None
+        """
+        with self.lock:
+            entry = self.snapshots.get(accountIdKey)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self.generationLocked(accountIdKey)
+
+        data = fetch()
+        if data is not None:
+            self.put(accountIdKey, data, generation)
+        return data
+
+    def generation(self, accountIdKey):
+        """
+        Returns the current generation of an account's entry, to be passed to put() with the fetched result
+        """
+        with self.lock:
+            return self.generationLocked(accountIdKey)
+
+    def generationLocked(self, accountIdKey):
+        return self.epoch, self.generations.get(accountIdKey, 0)
+
+    def put(self, accountIdKey, data, generation=None):
+        """
+        Stores the snapshot of an account
+
+        :param generation: generation read before the fetch started, the snapshot is dropped if the entry
+                           was invalidated since
+        :return True if the snapshot was stored
+        """
+        with self.lock:
+            if generation is not None and generation != self.generationLocked(accountIdKey):
+                return False
+            self.snapshots[accountIdKey] = (time.monotonic(), data)
+            return True
+
+    def age(self, accountIdKey):
+        """
+        Returns the seconds since the snapshot of an account was stored, or None if there is none
+        """
+        with self.lock:
+            entry = self.snapshots.get(accountIdKey)
+        return None if entry is None else time.monotonic() - entry[0]
+
+    def invalidate(self, accountIdKey=None):
+        """
+        Drops the snapshot of one account, or of every account if accountIdKey is None
+        """
+        with self.lock:
+            if accountIdKey is None:
+                self.snapshots.clear()
+                self.generations.clear()
+                self.epoch += 1
+            else:
+                self.snapshots.pop(accountIdKey, None)
+                self.generations[accountIdKey] = self.generations.get(accountIdKey, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self.snapshots)}
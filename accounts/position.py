@@ -0,0 +1,30 @@
+class Position:
+    """Fields of a portfolio position kept for the rebalancer and displays, instead of the full response dict"""
+    __slots__ = ("symbol", "quantity", "marketValue", "lastTrade", "totalGain", "pctOfPortfolio")
+
+    def __init__(self, symbol, quantity, marketValue, lastTrade, totalGain, pctOfPortfolio):
+        self.symbol = symbol
+        self.quantity = quantity
+        self.marketValue = marketValue
+        self.lastTrade = lastTrade
+        self.totalGain = totalGain
+        self.pctOfPortfolio = pctOfPortfolio
+
+    @classmethod
+    def fromResponse(cls, position):
+        """
+        Converts a position of the portfolio API response
+
+        :param position: position dict with at least symbolDescription, marketValue, totalGain and pctOfPortfolio
+        :return Position
+        """
+        quick = position.get("Quick")
+        return cls(position["symbolDescription"],
+                   position.get("quantity", 0),
+                   position["marketValue"],
+                   quick.get("lastTrade") if quick is not None else None,
+                   position["totalGain"],
+                   position["pctOfPortfolio"])
+
+    def __repr__(self):
+        return "Position({!r}, quantity={!r}, marketValue={!r})".format(self.symbol, self.quantity, self.marketValue)
@@ -0,0 +1,77 @@
+import json
+import logging
+import threading
+import time
+from urllib.parse import urlsplit
+import metrics
+import tracing
+
+logger = logging.getLogger('my_logger')
+
+# responses shared through single flight are decoded by one thread, the others wait for its result
+_parseLock = threading.Lock()
+
+
+class LazyJson:
+    """Pretty-prints a parsed body only when a log record is actually emitted"""
+    __slots__ = ("data",)
+
+    def __init__(self, data):
+        self.data = data
+
+    def __str__(self):
+        return json.dumps(self.data, indent=4, sort_keys=True)
+
+
+def decode(response):
+    """
+    Parses a response body exactly once, timing the parse, and logs the request header and body at DEBUG level
+
+    The parsed body is cached on the response, which single flight may hand to several callers at once, so it
+    is read-only: callers that need to change it work on a copy.
+
+    :param response: response object returned by the session
+    :return parsed body, or None if the body is empty or not JSON
+    """
+    if response is None:
+        return None
+    if "_parsed" in response.__dict__:
+        return response._parsed
+    with _parseLock:
+        if "_parsed" not in response.__dict__:
+            _parse(response)
+    return response._parsed
+
+
+def _parse(response):
+    """Parses and caches the body of a response that was not decoded yet, called under _parseLock"""
+    data = None
+    if response.content:
+        endpoint = metrics.endpoint_template(urlsplit(response.url or "").path)
+        start = time.perf_counter()
+        with tracing.span("decode", endpoint=endpoint):
+            try:
+                data = response.json()
+            except ValueError:
+                data = None
+        metrics.REGISTRY.observe_phase("parse", endpoint, time.perf_counter() - start)
+    response._parsed = data
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Request Header: %s", response.request.headers)
+        logger.debug("Response Body: %s", LazyJson(data) if data is not None else response.text)
+    return data
+
+
+def error_message(data, default):
+    """
+    Extracts the E*TRADE error message from a parsed body
+
+    :param data: parsed body as returned by decode
+    :param default: description used when the body carries no error message
+    :return message ready to be displayed
+    """
+    if isinstance(data, dict) and isinstance(data.get("Error"), dict) \
+            and data["Error"].get("message") is not None:
+        return "Error: " + data["Error"]["message"]
+    return "Error: " + default
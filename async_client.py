@@ -0,0 +1,110 @@
+"""Awaitable facade over the API calls of Accounts, Order and Market
+
+Requests are still signed by the rauth OAuth1 session and go through the transport stack mounted by
+transport.configure_session (single flight, rate limits, metrics, pooled connections). asyncio runs them on a
+bounded thread pool, so the calls for many accounts overlap instead of costing one round trip each:
+
+    async with AsyncClient(session, base_url) as client:
+        accounts = await client.account_list()
+        portfolios = await client.for_each_account(client.portfolio, accounts)
+"""
+import asyncio
+import configparser
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from accounts.accounts import Accounts
+from order.order import Order
+from market.market import Market
+
+# loading configuration file
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+asyncConcurrency = config["DEFAULT"].getint("ASYNC_CONCURRENCY", fallback=8)
+
+
+class AsyncClient:
+    def __init__(self, session, base_url, concurrency=None):
+        """
+        :param session: authenticated session
+        :param base_url: API base url
+        :param concurrency: largest number of calls in flight, ASYNC_CONCURRENCY by default
+        """
+        self.session = session
+        self.base_url = base_url
+        self.concurrency = concurrency or asyncConcurrency
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="async-client")
+        self.semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+    async def call(self, function, *args):
+        """
+        Runs a blocking API call on the client's thread pool once a concurrency slot is free
+        """
+        if self.semaphore is None:
+            # created here so it belongs to the running event loop
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(self.executor,
+                                                                    functools.partial(function, *args))
+
+    def accounts(self, account=None):
+        accounts = Accounts(self.session, self.base_url)
+        if account is not None:
+            accounts.account = account
+        return accounts
+
+    async def account_list(self):
+        """
+        :return list of open account dicts, or None on error
+        """
+        return await self.call(self.accounts().getAccounts)
+
+    async def portfolio(self, account):
+        """
+        :return parsed portfolio response with the positions of every page, or None on error
+        """
+        return await self.call(self.accounts(account).getPortfolio)
+
+    async def holdings(self, account):
+        """
+        :return dict of Position keyed by symbol, or None on error
+        """
+        return await self.call(self.accounts(account).createHoldingsDict)
+
+    async def balance(self, account):
+        """
+        :return parsed balance response, or the parsed error body
+        """
+        return await self.call(self.accounts(account).fetchBalance)
+
+    async def orders(self, account, status="OPEN"):
+        """
+        :return list of the account's order dicts with the given status, across all pages
+        :raises pagination.IncompletePages: a page after the first could not be retrieved
+        """
+        order = Order(self.session, account, self.base_url)
+        return await self.call(lambda: list(order.iter_orders(status)))
+
+    async def quotes(self, symbols):
+        """
+        :return dict of quote data keyed by symbol
+        """
+        return await self.call(Market(self.session, self.base_url).get_quotes, symbols)
+
+    async def for_each_account(self, function, accounts):
+        """
+        Awaits function(account) for every account concurrently, within the concurrency limit
+
+        :param function: coroutine function taking an account dict, e.g. client.portfolio
+        :return list of results in the order of accounts
+        """
+        return await asyncio.gather(*(function(account) for account in accounts))
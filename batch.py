@@ -0,0 +1,130 @@
+"""Non-interactive rebalance of one or more accounts, meant to be run from cron"""
+import asyncio
+import json
+import configparser
+import requests
+from accounts.accounts import Accounts, Rebalancer
+from async_client import AsyncClient
+from market.market import Market
+from order import pipeline
+from pagination import IncompletePages
+import securities
+
+# loading configuration file
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+batchWorkers = config["DEFAULT"].getint("BATCH_WORKERS", fallback=8)
+
+
+def select_accounts(accounts, selectors):
+    """
+    Picks the brokerage accounts named on the command line
+
+    :param accounts: open accounts as returned by Accounts.getAccounts
+    :param selectors: "all" or a comma separated list of account ids or account id keys
+    :return list of account dicts
+    """
+    brokerage = [account for account in accounts if account.get("institutionType") == "BROKERAGE"]
+    if selectors == "all":
+        return brokerage
+    wanted = set(selector.strip() for selector in selectors.split(","))
+    return [account for account in brokerage
+            if account.get("accountId") in wanted or account.get("accountIdKey") in wanted]
+
+
+async def fetch_account(client, account):
+    """
+    Fetches the holdings of one account
+
+    :return tuple of the JSON serializable result of the account and its holdings (None on error)
+    """
+    result = {"accountId": account.get("accountId"),
+              "accountIdKey": account.get("accountIdKey"),
+              "accountDesc": account.get("accountDesc", "").strip()}
+    try:
+        holdings = await client.holdings(account)
+    except (requests.RequestException, IncompletePages) as e:
+        # a failed account is reported in its result, the other accounts are still rebalanced
+        result["error"] = "Portfolio API service error: {}".format(e)
+        return result, None
+    if holdings is None:
+        result["error"] = "Portfolio API service error"
+    else:
+        result["currentDistribution"] = Rebalancer(holdings, verbose=False).currentDistribution()
+        result["uncategorizedHoldings"] = securities.uncategorized(holdings)
+    return result, holdings
+
+
+async def fetch_selected(session, base_url, accounts):
+    """
+    Fetches the holdings of the accounts concurrently, at most BATCH_WORKERS at a time
+
+    :return list of fetch_account results, in the order of accounts
+    """
+    async with AsyncClient(session, base_url, batchWorkers) as client:
+        return await client.for_each_account(lambda account: fetch_account(client, account), accounts)
+
+
+def order_purchases(session, base_url, rebalanced, dry_run):
+    """
+    Plans whole-share orders for the purchase of every result, then previews and places them unless dry_run
+
+    :param rebalanced: list of fetch_account results with their purchase
+    :param dry_run: only plan the orders
+    """
+    weights = securities.purchase_weights()
+    try:
+        prices = Market.last_prices(Market(session, base_url).get_quotes(
+            [symbol for category in weights.values() for symbol in category]))
+    except requests.RequestException as e:
+        # without prices no order can be planned, the purchases are still written
+        for result in rebalanced:
+            result["error"] = "Quote API service error: {}".format(e)
+        return
+    planned = [(result, pipeline.plan_orders(result["accountIdKey"], result["purchase"], prices, weights))
+               for result in rebalanced]
+    if not dry_run:
+        # the orders of every account go through the pipeline together
+        pipeline.OrderPipeline(session, base_url).run([order for result, orders in planned for order in orders])
+    for result, orders in planned:
+        result["orders"] = [order.to_dict() for order in orders]
+        failed = [order for order in orders if order.status in (pipeline.REJECTED, pipeline.FAILED)]
+        unknown = [order for order in orders if order.status == pipeline.UNKNOWN]
+        errors = []
+        if failed:
+            errors.append("{} order(s) not placed".format(len(failed)))
+        if unknown:
+            errors.append("{} order(s) with an unknown outcome, check the open orders".format(len(unknown)))
+        if errors:
+            result["error"] = ", ".join(errors)
+
+
+def run_rebalance(session, base_url, selectors, dry_run, output):
+    """
+    Rebalances every selected account in parallel and writes the results as JSON
+
+    :param session: authenticated session
+    :param base_url: API base url
+    :param selectors: "all" or a comma separated list of account ids
+    :param dry_run: compute purchases and orders without previewing or placing any order
+    :param output: path of the JSON results file
+    :return 0 if every account was rebalanced, 1 otherwise
+    """
+    accounts = Accounts(session, base_url).getAccounts()
+    if accounts is None:
+        return 1
+    fetched = asyncio.run(fetch_selected(session, base_url, select_accounts(accounts, selectors)))
+    results = [result for result, holdings in fetched]
+
+    # one allocation over every account that could be fetched
+    rebalanced = [(result, holdings) for result, holdings in fetched if holdings is not None]
+    purchases = Rebalancer.rebalanceAccounts([holdings for result, holdings in rebalanced])
+    for (result, holdings), purchase in zip(rebalanced, purchases):
+        result["purchase"] = purchase
+    order_purchases(session, base_url, [result for result, holdings in rebalanced], dry_run)
+
+    with open(output, "w") as f:
+        json.dump({"dryRun": dry_run, "accounts": results}, f, indent=4)
+    print("Rebalanced {} account(s), results written to {}".format(len(results), output))
+    return 1 if any("error" in result for result in results) else 0
@@ -0,0 +1,141 @@
+"""Benchmarks of the rebalance, parsing and rendering hot paths on synthetic portfolios
+
+Run from the repository root: python -m benchmarks.bench_hotpaths --sizes 10,1000,100000
+
+Every run is appended to a JSON history file. The first run, or a run with --update-baseline, becomes the
+baseline; the command exits with status 1 when a median latency is slower than the baseline by more than
+--threshold.
+"""
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import synthetic_data
+from accounts.accounts import Accounts, Rebalancer
+from accounts.allocation import whole_shares
+from order.order import Order
+
+DEFAULT_SIZES = [10, 100, 1000, 10000, 100000]
+
+
+def hot_paths(size):
+    """
+    Builds the benchmarked callables for one portfolio size
+
+    :return dict of benchmark name -> callable without arguments
+    """
+    portfolio = synthetic_data.portfolio_response(positions=size)
+    orders = synthetic_data.orders_response(size, statuses=["EXECUTED"])
+    accounts = Accounts(None, "")
+    holdings = accounts.createStockDict(portfolio)
+    prices = {symbol: synthetic_data.price_of(symbol) for symbol in synthetic_data.position_symbols(size)}
+    targets = {symbol: price * 2.5 for symbol, price in prices.items()}
+    return {"Rebalancer.rebalance": lambda: Rebalancer(holdings, verbose=False).rebalance(),
+            "Accounts.createStockDict": lambda: accounts.createStockDict(portfolio),
+            "Accounts.displayBalanceInfo": lambda: accounts.displayBalanceInfo(portfolio),
+            "Order.print_orders": lambda: Order.print_orders(orders, "executed"),
+            "allocation.whole_shares": lambda: whole_shares(targets, prices)}
+
+
+def measure(func, min_time, max_runs):
+    """
+    Calls func until min_time has elapsed (at least 3 and at most max_runs times)
+
+    :return dict of ops/sec, latency percentiles in milliseconds and peak traced memory in bytes
+    """
+    latencies = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started = time.perf_counter()
+        while len(latencies) < 3 or (time.perf_counter() - started < min_time and len(latencies) < max_runs):
+            start = time.perf_counter()
+            func()
+            latencies.append(time.perf_counter() - start)
+
+        # memory is traced in a separate call, tracing slows the timed calls down
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    latencies.sort()
+    return {"runs": len(latencies),
+            "ops_per_sec": len(latencies) / sum(latencies),
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "mean_ms": statistics.mean(latencies) * 1000,
+            "peak_bytes": peak}
+
+
+def percentile(sorted_values, pct):
+    index = min(int(round(pct / 100 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+def regressions(results, baseline, threshold):
+    """
+    Lists the benchmarks whose median latency grew by more than threshold against the baseline
+    """
+    slower = []
+    for key, result in results.items():
+        if key in baseline and baseline[key]["p50_ms"] > 0:
+            change = result["p50_ms"] / baseline[key]["p50_ms"] - 1
+            if change > threshold:
+                slower.append((key, baseline[key]["p50_ms"], result["p50_ms"], change))
+    return slower
+
+
+def load_history(path):
+    if os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"baseline": None, "runs": []}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the rebalance, parsing and rendering hot paths")
+    parser.add_argument("--sizes", default=",".join(str(size) for size in DEFAULT_SIZES),
+                        help="comma separated portfolio sizes")
+    parser.add_argument("--min-time", type=float, default=0.5, help="seconds spent on each benchmark")
+    parser.add_argument("--max-runs", type=int, default=1000)
+    parser.add_argument("--history", default=os.path.join("benchmarks", "history.json"))
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="allowed median latency increase over the baseline, 0.25 = 25%%")
+    parser.add_argument("--update-baseline", action="store_true", help="store this run as the new baseline")
+    parser.add_argument("--no-save", action="store_true", help="do not append this run to the history")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for size in [int(size) for size in args.sizes.split(",")]:
+        for name, func in hot_paths(size).items():
+            key = "{}[{}]".format(name, size)
+            results[key] = measure(func, args.min_time, args.max_runs)
+            print("{:<38} {:>10.1f} ops/s  p50 {:>9.3f} ms  p95 {:>9.3f} ms  p99 {:>9.3f} ms  peak {:>8.1f} KiB".format(
+                key, results[key]["ops_per_sec"], results[key]["p50_ms"], results[key]["p95_ms"],
+                results[key]["p99_ms"], results[key]["peak_bytes"] / 1024))
+
+    history = load_history(args.history)
+    slower = regressions(results, history["baseline"]["results"], args.threshold) if history["baseline"] else []
+    for key, before, after, change in slower:
+        print("REGRESSION {}: p50 {:.3f} ms -> {:.3f} ms (+{:.0%})".format(key, before, after, change))
+
+    if not args.no_save:
+        run = {"timestamp": datetime.now(timezone.utc).isoformat(),
+               "python": platform.python_version(),
+               "results": results}
+        history["runs"].append(run)
+        if history["baseline"] is None or args.update_baseline:
+            history["baseline"] = run
+        with open(args.history, "w") as f:
+            json.dump(history, f, indent=2)
+    return 1 if slower else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,64 @@
+"""Microbenchmark of the CPU time spent handling one API response body, before and after api_response.decode
+
+Run from the repository root: python -m benchmarks.bench_response
+"""
+import argparse
+import io
+import json
+import logging
+import time
+import requests
+from api_response import decode
+
+logger = logging.getLogger('my_logger')
+
+
+def make_response(body):
+    response = requests.Response()
+    response.status_code = 200
+    response._content = body
+    response.encoding = "utf-8"
+    response.request = requests.Request("GET", "https://api.etrade.com/v1/accounts/key/portfolio.json").prepare()
+    return response
+
+
+def legacy_decode(response):
+    """Response handling as every handler did it before: parse, pretty-print for the log, parse again"""
+    logger.debug("Request Header: %s", response.request.headers)
+    parsed = json.loads(response.text)
+    logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
+    return response.json()
+
+
+def cpu_time_per_response(handler, body, iterations):
+    start = time.process_time()
+    for _ in range(iterations):
+        handler(make_response(body))
+    return (time.process_time() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU time per response before and after the single-parse pipeline")
+    parser.add_argument("--file", default="fakeData.json", help="response body to decode")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    with open(args.file, "rb") as f:
+        body = f.read()
+
+    # log records are formatted into memory so disk speed does not skew the DEBUG numbers
+    handler = logging.StreamHandler(io.StringIO())
+    logger.handlers = [handler]
+    logger.propagate = False
+
+    print("{} bytes per response, {} iterations".format(len(body), args.iterations))
+    for level in (logging.INFO, logging.DEBUG):
+        logger.setLevel(level)
+        before = cpu_time_per_response(legacy_decode, body, args.iterations)
+        after = cpu_time_per_response(decode, body, args.iterations)
+        print("{:<5}  before: {:8.1f} us  after: {:8.1f} us  speedup: {:.1f}x".format(
+            logging.getLevelName(level), before * 1e6, after * 1e6, before / after))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 """This Python script provides examples on using the E*TRADE API endpoints"""
 from __future__ import print_function
+import argparse
+import atexit
 import webbrowser
 import json
 import logging
@@ -7,30 +9,36 @@ import configparser
 import sys
 import requests
 from rauth import OAuth1Service
-from logging.handlers import RotatingFileHandler
+from log_setup import setup_logging
+import token_store
+import transport
+import metrics
+import tracing
 from accounts.accounts import Accounts
 from market.market import Market
+import batch
+import sharding
+import prefetch
 
 # loading configuration file
 config = configparser.ConfigParser()
 config.read('config.ini')
 
 # logger settings
-logger = logging.getLogger('my_logger')
-logger.setLevel(logging.DEBUG)
-handler = RotatingFileHandler("python_client.log", maxBytes=5*1024*1024, backupCount=3)
-FORMAT = "%(asctime)-15s %(message)s"
-fmt = logging.Formatter(FORMAT, datefmt='%m/%d/%Y %I:%M:%S %p')
-handler.setFormatter(fmt)
-logger.addHandler(handler)
+logger = setup_logging(config["DEFAULT"])
+
+# metrics export, see metrics.py
+metrics.configure_export(config["DEFAULT"])
 
 # testing mode
 devMode = False if config["DEFAULT"]["DEVMODE"] == "False" else  True
 
-def oauth():
-    
-    """Allows user authorization for the sample application with OAuth 1"""
-    etrade = OAuth1Service(
+# stored OAuth access token
+tokenFile = config["DEFAULT"].get("TOKEN_FILE", ".etrade_token.json")
+RENEW_ACCESS_TOKEN_URL = "https://api.etrade.com/oauth/renew_access_token"
+
+def create_service():
+    return OAuth1Service(
         name="etrade",
         consumer_key=config["DEFAULT"]["CONSUMER_KEY"],
         consumer_secret=config["DEFAULT"]["CONSUMER_SECRET"],
@@ -39,15 +47,88 @@ def oauth():
         authorize_url="https://us.etrade.com/e/t/etws/authorize?key={}&token={}",
         base_url="https://api.etrade.com")
 
+
+def oauth():
+    """Allows user authorization for the sample application with OAuth 1"""
+    etrade = create_service()
+
+    if(devMode):
+        print("Currently running in Devmode, responses are replayed offline")
+    session, base_url = create_session(etrade)
+    # warm the account caches while the menus load
+    prefetch.start_prefetch(session, base_url, config["DEFAULT"])
+
+    # the time of the last request decides whether the next start has to renew the token
+    atexit.register(touch_token)
+
+    main_menu(session, base_url)
+
+
+def create_session(etrade, interactive=True):
+    """
+    Creates the session used for every API call, with the transport selected in config.ini mounted under it
+
+    :param etrade: OAuth1Service of the E*TRADE API
+    :param interactive: run the browser flow when no stored token can be used
+    :return tuple of session and base url, or (None, None) if there is no usable token
+    """
+    if transport.is_offline(config["DEFAULT"], devMode):
+        # replayed responses need no credentials, requests are signed with placeholder tokens
+        session = etrade.get_session(("offline", "offline"))
+        base_url = config["DEFAULT"]["SANDBOX_BASE_URL"]
+    else:
+        session, base_url = restore_session(etrade)
+        if session is None and interactive:
+            session, base_url = authorize(etrade)
+    if session is not None:
+        transport.configure_session(session, config["DEFAULT"], devMode)
+        atexit.register(log_connection_stats, session)
+    return session, base_url
+
+
+def restore_session(etrade):
+    """
+    Rebuilds an authenticated session from the stored access token, renewing it if it went idle
+
+    :param etrade: OAuth1Service of the E*TRADE API
+    :return tuple of authenticated session and base url, or (None, None) if the user has to authorize again
+    """
+    token = token_store.load_token(tokenFile)
+    if token is None or token["consumer_key"] != etrade.consumer_key or token_store.is_expired(token):
+        return None, None
+
+    session = etrade.get_session((token["access_token"], token["access_token_secret"]))
+    if token_store.is_idle(token):
+        response = session.get(RENEW_ACCESS_TOKEN_URL, header_auth=True)
+        logger.debug("Renew access token: %s %s", response.status_code, response.text)
+        if response.status_code != 200:
+            return None, None
+    token_store.touch(tokenFile, token)
+    return session, token["base_url"]
+
+
+def log_connection_stats(session):
+    logger.debug("Connection reuse: %s", transport.connection_stats(session))
+
+
+def touch_token():
+    token = token_store.load_token(tokenFile)
+    if token is not None:
+        token_store.touch(tokenFile, token)
+
+
+def authorize(etrade):
+    """
+    Runs the interactive OAuth 1 flow in the browser and stores the resulting access token
+
+    :param etrade: OAuth1Service of the E*TRADE API
+    :return tuple of authenticated session and base url
+    """
     menu_items = {"1": "Sandbox Consumer Key",
                   "2": "Live Consumer Key",
                   "3": "Exit"}
     while True:
         print("")
-        if(devMode):
-            print("Currently running in Devmode")
-            print(devMode)
-            print("")
         options = menu_items.keys()
         for entry in options:
             print(entry + ")\t" + menu_items[entry])
@@ -59,7 +140,7 @@ def oauth():
             base_url = config["DEFAULT"]["PROD_BASE_URL"]
             break
         elif selection == "3":
-            break
+            sys.exit()
         else:
             print("Unknown Option Selected!")
     print("")
@@ -79,7 +160,11 @@ def oauth():
                                   request_token_secret,
                                   params={"oauth_verifier": text_code})
 
-    main_menu(session, base_url)
+    # Step 4: Keep the access token so the next start can skip the browser
+    token_store.save_token(tokenFile, token_store.new_token(
+        session.access_token, session.access_token_secret, etrade.consumer_key, base_url))
+
+    return session, base_url
 
 
 def main_menu(session, base_url):
@@ -111,5 +196,47 @@ def main_menu(session, base_url):
             print("Unknown Option Selected!")
 
 
+def batch_rebalance(args):
+    """
+    Rebalances accounts without any prompt, using the stored access token
+
+    :param args: parsed arguments of the rebalance command
+    :return process exit code
+    """
+    session, base_url = create_session(create_service(), interactive=False)
+    if session is None:
+        print("Error: no valid stored access token, run the interactive client once to authorize")
+        return 1
+    if args.processes != 1:
+        return sharding.run_sharded_rebalance(session, base_url, args.accounts, not args.place, args.output,
+                                              args.processes, tokenFile, devMode)
+    return batch.run_rebalance(session, base_url, args.accounts, not args.place, args.output)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="E*TRADE portfolio management bot, interactive when run without a command")
+    subparsers = parser.add_subparsers(dest="command")
+    rebalance_parser = subparsers.add_parser("rebalance", help="rebalance accounts without any prompt")
+    rebalance_parser.add_argument("--accounts", default="all",
+                                  help='"all" or a comma separated list of account ids (default: all)')
+    # orders are only placed on request, a scheduled run computes purchases unless --place is given
+    mode = rebalance_parser.add_mutually_exclusive_group()
+    mode.add_argument("--dry-run", action="store_true",
+                      help="compute purchases and orders without placing them (the default)")
+    mode.add_argument("--place", action="store_true", help="preview and place the orders of every account")
+    rebalance_parser.add_argument("--output", default="rebalance_results.json", help="JSON results file")
+    rebalance_parser.add_argument("--processes", type=int, default=1,
+                                  help="worker processes sharing the accounts, 0 for one per core (default: 1)")
+    parser.add_argument("--profile", action="store_true", help="run under cProfile and save a sorted stats report")
+    parser.add_argument("--profile-output", default="profile_stats.txt", help="cProfile report file")
+    args = parser.parse_args(argv)
+
+    with tracing.profiled(args.profile_output if args.profile else None):
+        if args.command == "rebalance":
+            sys.exit(batch_rebalance(args))
+        else:
+            oauth()
+
+
 if __name__ == "__main__":
-   oauth()
+    main(sys.argv[1:])
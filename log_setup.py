@@ -0,0 +1,86 @@
+import atexit
+import copy
+import logging
+import multiprocessing
+import queue
+import threading
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOGGER_NAME = 'my_logger'
+FORMAT = "%(asctime)-15s %(message)s"
+DATE_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+
+_listener = None
+_lock = threading.Lock()
+
+
+class TruncatingFormatter(logging.Formatter):
+    """Formatter that caps each message so large response bodies cannot flood the log"""
+
+    def __init__(self, fmt, datefmt, maxChars):
+        super().__init__(fmt, datefmt=datefmt)
+        self.maxChars = maxChars
+
+    def format(self, record):
+        # the rotating handler formats each record twice, the message is rendered and capped only once
+        if not getattr(record, "capped", False):
+            message = record.getMessage()
+            if self.maxChars > 0 and len(message) > self.maxChars:
+                message = message[:self.maxChars] + \
+                    " ... [truncated {} characters]".format(len(message) - self.maxChars)
+            record.msg, record.args, record.capped = message, None, True
+        return super().format(record)
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves the formatting to the listener thread"""
+
+    def prepare(self, record):
+        # the message and its arguments are formatted by the listener, so response bodies are never rendered
+        # on the thread that made the request, and the arguments must not be changed after the call
+        record = copy.copy(record)
+        if record.exc_info:
+            # the traceback is rendered now, while its frames are still those of the error
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(settings=None):
+    """
+    Attaches the single file handler of my_logger, later calls return the already configured logger
+
+    Records are handed unformatted to a QueueListener thread that formats them and does the file I/O.
+
+    :param settings: config section providing the optional LOG_* keys, defaults are used when None
+    :return the configured logger
+    """
+    global _listener
+    settings = settings if settings is not None else {}
+    logger = logging.getLogger(LOGGER_NAME)
+
+    with _lock:
+        if _listener is not None:
+            return logger
+
+        if multiprocessing.parent_process() is None:
+            fileHandler = RotatingFileHandler(
+                settings.get("LOG_FILE", "python_client.log"),
+                maxBytes=int(settings.get("LOG_MAX_BYTES", 5 * 1024 * 1024)),
+                backupCount=int(settings.get("LOG_BACKUP_COUNT", 3)))
+        else:
+            # worker processes append to the same file and leave the rotation to the main process
+            fileHandler = logging.FileHandler(settings.get("LOG_FILE", "python_client.log"))
+        fileHandler.setFormatter(TruncatingFormatter(
+            FORMAT, DATE_FORMAT, int(settings.get("LOG_MAX_BODY_CHARS", 10000))))
+
+        queueHandler = DeferredQueueHandler(queue.SimpleQueue())
+
+        logger.setLevel(settings.get("LOG_LEVEL", "INFO").upper())
+        logger.addHandler(queueHandler)
+        logger.propagate = False
+
+        _listener = QueueListener(queueHandler.queue, fileHandler)
+        _listener.start()
+        atexit.register(_listener.stop)
+    return logger
@@ -1,15 +1,21 @@
-import json
 import logging
-from logging.handlers import RotatingFileHandler
+import configparser
+from concurrent.futures import ThreadPoolExecutor
+import securities
+from api_response import decode
 
-# logger settings
+# loading configuration file
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# logger, handlers are attached once by log_setup.setup_logging
 logger = logging.getLogger('my_logger')
-logger.setLevel(logging.DEBUG)
-handler = RotatingFileHandler("python_client.log", maxBytes=5 * 1024 * 1024, backupCount=3)
-FORMAT = "%(asctime)-15s %(message)s"
-fmt = logging.Formatter(FORMAT, datefmt='%m/%d/%Y %I:%M:%S %p')
-handler.setFormatter(fmt)
-logger.addHandler(handler)
+
+# quote API accepts 25 symbols per request, or 50 when overrideSymbolCount is set
+MAX_QUOTE_SYMBOLS = 50
+DEFAULT_QUOTE_SYMBOLS = 25
+quoteBatchSize = min(config["DEFAULT"].getint("QUOTE_BATCH_SIZE", fallback=MAX_QUOTE_SYMBOLS), MAX_QUOTE_SYMBOLS)
+quoteFetchWorkers = config["DEFAULT"].getint("QUOTE_FETCH_WORKERS", fallback=4)
 
 
 class Market:
@@ -30,16 +36,12 @@ class Market:
 
         # Make API call for GET request
         response = self.session.get(url)
-        logger.debug("Request Header: %s", response.request.headers)
 
+        data = decode(response)
         if response is not None and response.status_code == 200:
 
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-
             # Handle and parse response
             print("")
-            data = response.json()
             if data is not None and "QuoteResponse" in data and "QuoteData" in data["QuoteResponse"]:
                 for quote in data["QuoteResponse"]["QuoteData"]:
                     if quote is not None and "dateTime" in quote:
@@ -78,5 +80,79 @@ class Market:
                 else:
                     print("Error: Quote API service error")
         else:
-            logger.debug("Response Body: %s", response)
             print("Error: Quote API service error")
+
+    def get_quotes(self, symbols):
+        """
+        Calls quotes API for a list of symbols, split into as few requests as the API allows and sent concurrently
+
+        :param self: Passes authenticated session in parameter
+        :param symbols: iterable of stock or mutual fund symbols
+        :return dict of quote data keyed by symbol
+        """
+        unique_symbols = list(dict.fromkeys(symbol.strip().upper() for symbol in symbols if symbol.strip()))
+        chunks = [unique_symbols[i:i + quoteBatchSize] for i in range(0, len(unique_symbols), quoteBatchSize)]
+        if len(chunks) == 0:
+            return {}
+
+        quotes = {}
+        with ThreadPoolExecutor(max_workers=max(min(len(chunks), quoteFetchWorkers), 1)) as executor:
+            for chunk_quotes in executor.map(self.fetch_quote_chunk, chunks):
+                quotes.update(chunk_quotes)
+        return quotes
+
+    def fetch_quote_chunk(self, symbols):
+        """
+        Calls quotes API for at most MAX_QUOTE_SYMBOLS symbols
+
+        :param self: Passes authenticated session in parameter
+        :param symbols: list of symbols
+        :return dict of quote data keyed by symbol
+        """
+        # URL for the API endpoint
+        url = self.base_url + "/v1/market/quote/" + ",".join(symbols) + ".json"
+        params = {"overrideSymbolCount": "true"} if len(symbols) > DEFAULT_QUOTE_SYMBOLS else {}
+
+        # Make API call for GET request
+        response = self.session.get(url, params=params)
+
+        quotes = {}
+        data = decode(response)
+        if response is not None and response.status_code == 200:
+            if data is not None and "QuoteResponse" in data and "QuoteData" in data["QuoteResponse"]:
+                for quote in data["QuoteResponse"]["QuoteData"]:
+                    if quote is not None and "Product" in quote and "symbol" in quote["Product"]:
+                        quotes[quote["Product"]["symbol"]] = quote
+            if data is not None and 'QuoteResponse' in data and 'Messages' in data["QuoteResponse"] \
+                    and 'Message' in data["QuoteResponse"]["Messages"] \
+                    and data["QuoteResponse"]["Messages"]["Message"] is not None:
+                for error_message in data["QuoteResponse"]["Messages"]["Message"]:
+                    print("Error: " + error_message["description"])
+        else:
+            print("Error: Quote API service error")
+        return quotes
+
+    def securities_quotes(self):
+        """
+        Calls quotes API for every symbol of the securities classification table
+
+        :param self: Passes authenticated session in parameter
+        :return dict of quote data keyed by symbol
+        """
+        return self.get_quotes(securities.symbols())
+
+    @staticmethod
+    def last_prices(quotes):
+        """
+        Extracts the last price of each quote, using net asset value for mutual funds
+
+        :param quotes: dict of quote data keyed by symbol, as returned by get_quotes
+        :return dict of prices keyed by symbol
+        """
+        prices = {}
+        for symbol, quote in quotes.items():
+            if "All" in quote and "lastTrade" in quote["All"]:
+                prices[symbol] = quote["All"]["lastTrade"]
+            elif "MutualFund" in quote and "netAssetValue" in quote["MutualFund"]:
+                prices[symbol] = quote["MutualFund"]["netAssetValue"]
+        return prices
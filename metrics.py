@@ -0,0 +1,299 @@
+"""Per-endpoint request metrics in Prometheus text format
+
+MetricsAdapter in transport.py records every request of the session: count, error count, response bytes and a
+latency histogram, keyed by method and endpoint template such as /v1/accounts/{id}/portfolio. decode() and the
+rendering functions add parse and render timings. Set METRICS_FILE in config.ini to write the metrics when the
+program exits, or METRICS_PORT to serve them on http://127.0.0.1:<port>/metrics.
+"""
+import atexit
+import bisect
+import multiprocessing
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# histogram upper bounds in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+@lru_cache(maxsize=1024)
+def endpoint_template(path):
+    """
+    Replaces the account keys, symbols and ids of a URL path by placeholders
+
+    /v1/accounts/6_Dpy0rmuQ9cu9IbTfvF2A/portfolio.json -> /v1/accounts/{id}/portfolio
+    """
+    segments = path.split("/")
+    template = []
+    for index, segment in enumerate(segments):
+        if segment.endswith(".json"):
+            segment = segment[:-len(".json")]
+        previous = segments[index - 1] if index > 0 else ""
+        if previous == "accounts" and segment != "list":
+            segment = "{id}"
+        elif previous == "quote":
+            segment = "{symbols}"
+        elif segment.isdigit():
+            segment = "{n}"
+        template.append(segment)
+    return "/".join(template)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def merge(self, other):
+        self.counts = [count + otherCount for count, otherCount in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+
+class EndpointStats:
+    __slots__ = ("requests", "errors", "bytes", "latency")
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.latency = Histogram()
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.phases = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe_request(self, method, path, seconds, nbytes=0, error=False):
+        """
+        Records one API call
+
+        :param method: HTTP method
+        :param path: URL path, reduced to its endpoint template
+        :param seconds: time from sending the request to receiving the response
+        :param nbytes: size of the response body
+        :param error: the call failed or returned an error status
+        """
+        key = (method, endpoint_template(path))
+        with self.lock:
+            stats = self.endpoints.get(key)
+            if stats is None:
+                stats = self.endpoints[key] = EndpointStats()
+            stats.requests += 1
+            stats.errors += 1 if error else 0
+            stats.bytes += nbytes
+            stats.latency.observe(seconds)
+
+    def observe_phase(self, phase, name, seconds):
+        """
+        Records the time spent in a client side phase such as parse or render
+        """
+        with self.lock:
+            histogram = self.phases.get((phase, name))
+            if histogram is None:
+                histogram = self.phases[(phase, name)] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, counter, path, amount=1):
+        """
+        Adds amount to an event counter of the endpoint, exported as etrade_<counter>_total
+        """
+        key = (counter, endpoint_template(path))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def add_gauge(self, name, description, function):
+        """
+        Exports the value returned by function as etrade_<name>, replacing any gauge of the same name
+        """
+        with self.lock:
+            self.gauges[name] = (description, function)
+
+    @contextmanager
+    def timed(self, phase, name=""):
+        """
+        Times the enclosed block, or every call when used as a decorator
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_phase(phase, name, time.perf_counter() - start)
+
+    def take(self):
+        """
+        Returns the recorded requests, phases and counters and starts over, so a worker process can hand them to
+        the coordinator's merge()
+
+        :return picklable tuple of endpoints, phases and counters
+        """
+        with self.lock:
+            taken = (self.endpoints, self.phases, self.counters)
+            self.endpoints, self.phases, self.counters = {}, {}, {}
+        return taken
+
+    def merge(self, taken):
+        """
+        Adds the metrics returned by take() in another process, gauges are not carried over
+        """
+        endpoints, phases, counters = taken
+        with self.lock:
+            for key, other in endpoints.items():
+                stats = self.endpoints.get(key)
+                if stats is None:
+                    stats = self.endpoints[key] = EndpointStats()
+                stats.requests += other.requests
+                stats.errors += other.errors
+                stats.bytes += other.bytes
+                stats.latency.merge(other.latency)
+            for key, other in phases.items():
+                histogram = self.phases.get(key)
+                if histogram is None:
+                    histogram = self.phases[key] = Histogram()
+                histogram.merge(other)
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.endpoints.clear()
+            self.phases.clear()
+            self.counters.clear()
+
+    def to_prometheus(self):
+        """
+        Renders every metric in the Prometheus text exposition format
+        """
+        with self.lock:
+            endpoints = sorted(self.endpoints.items())
+            phases = sorted(self.phases.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+
+        lines = ["# HELP etrade_requests_total API calls per endpoint",
+                 "# TYPE etrade_requests_total counter"]
+        lines += ['etrade_requests_total{{{}}} {}'.format(request_labels(key), stats.requests)
+                  for key, stats in endpoints]
+        lines += ["# HELP etrade_request_errors_total API calls that failed or returned an error status",
+                  "# TYPE etrade_request_errors_total counter"]
+        lines += ['etrade_request_errors_total{{{}}} {}'.format(request_labels(key), stats.errors)
+                  for key, stats in endpoints]
+        lines += ["# HELP etrade_response_bytes_total Response body bytes received per endpoint",
+                  "# TYPE etrade_response_bytes_total counter"]
+        lines += ['etrade_response_bytes_total{{{}}} {}'.format(request_labels(key), stats.bytes)
+                  for key, stats in endpoints]
+        lines += ["# HELP etrade_request_duration_seconds API call latency per endpoint",
+                  "# TYPE etrade_request_duration_seconds histogram"]
+        for key, stats in endpoints:
+            lines += histogram_lines("etrade_request_duration_seconds", request_labels(key), stats.latency)
+        lines += ["# HELP etrade_phase_duration_seconds Time spent parsing and rendering responses",
+                  "# TYPE etrade_phase_duration_seconds histogram"]
+        for (phase, name), histogram in phases:
+            labels = 'phase="{}",name="{}"'.format(escape(phase), escape(name))
+            lines += histogram_lines("etrade_phase_duration_seconds", labels, histogram)
+        for index, ((counter, endpoint), value) in enumerate(counters):
+            if index == 0 or counters[index - 1][0][0] != counter:
+                lines.append("# TYPE etrade_{}_total counter".format(counter))
+            lines.append('etrade_{}_total{{endpoint="{}"}} {}'.format(counter, escape(endpoint), value))
+        for name, (description, function) in gauges:
+            lines += ["# HELP etrade_{} {}".format(name, description),
+                      "# TYPE etrade_{} gauge".format(name),
+                      "etrade_{} {}".format(name, function())]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Writes the metrics to path, replacing the previous file atomically
+        """
+        temp = path + ".tmp"
+        with open(temp, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(temp, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serves the metrics on http://host:port/metrics from a daemon thread
+
+        :return the server, shutdown() stops it
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.to_prometheus().encode("utf-8")
+                self.send_response(200 if self.path.startswith("/metrics") else 404)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+
+def escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def request_labels(key):
+    return 'method="{}",endpoint="{}"'.format(escape(key[0]), escape(key[1]))
+
+
+def histogram_lines(name, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), histogram.counts):
+        cumulative += count
+        lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, labels, bound, cumulative))
+    lines.append("{}_sum{{{}}} {}".format(name, labels, histogram.sum))
+    lines.append("{}_count{{{}}} {}".format(name, labels, histogram.count))
+    return lines
+
+
+# registry shared by the transport, decode() and the rendering functions
+REGISTRY = Metrics()
+timed = REGISTRY.timed
+
+_exporting = False
+_lock = threading.Lock()
+
+
+def configure_export(settings):
+    """
+    Starts the exports selected by the optional METRICS_FILE and METRICS_PORT config keys, once, in the main process
+
+    :param settings: config section
+    """
+    global _exporting
+    if multiprocessing.parent_process() is not None:
+        # worker processes re-import the main module, only the coordinator exports, with the metrics the
+        # workers hand back merged in
+        return
+    with _lock:
+        if _exporting:
+            return
+        _exporting = True
+    if settings.get("METRICS_FILE"):
+        atexit.register(REGISTRY.write, settings["METRICS_FILE"])
+    if settings.get("METRICS_PORT"):
+        REGISTRY.serve(int(settings["METRICS_PORT"]))
@@ -1,23 +1,29 @@
-import json
 import logging
-from logging.handlers import RotatingFileHandler
 import configparser
 import random
 import re
+from concurrent.futures import ThreadPoolExecutor
+from pagination import prefetched_pages, IncompletePages
+from api_response import decode, error_message
+from accounts.context_cache import ordersCache
+import metrics
+import tracing
 
 # loading configuration file
 config = configparser.ConfigParser()
 config.read('config.ini')
 
-# logger settings
+# logger, handlers are attached once by log_setup.setup_logging
 logger = logging.getLogger('my_logger')
-logger.setLevel(logging.DEBUG)
-handler = RotatingFileHandler("python_client.log", maxBytes=5 * 1024 * 1024, backupCount=3)
-FORMAT = "%(asctime)-15s %(message)s"
-fmt = logging.Formatter(FORMAT, datefmt='%m/%d/%Y %I:%M:%S %p')
-handler.setFormatter(fmt)
-logger.addHandler(handler)
 
+# order statuses shown by view_orders, in display order: (API status, heading, print_orders status)
+ORDER_STATUSES = [("OPEN", "Open Orders", "open"),
+                  ("EXECUTED", "Executed Orders", "executed"),
+                  ("INDIVIDUAL_FILLS", "Individual Fills Orders", "indiv_fills"),
+                  ("CANCELLED", "Cancelled Orders", "cancelled"),
+                  ("REJECTED", "Rejected Orders", "rejected"),
+                  ("EXPIRED", "Expired Orders", "expired")]
+orders_page_size = config["DEFAULT"].getint("ORDERS_PAGE_SIZE", fallback=100)
 
 class Order:
 
@@ -70,14 +76,11 @@ class Order:
 
         # Make API call for POST request
         response = self.session.post(url, header_auth=True, headers=headers, data=payload)
-        logger.debug("Request Header: %s", response.request.headers)
         logger.debug("Request payload: %s", payload)
 
         # Handle and parse response
+        data = decode(response)
         if response is not None and response.status_code == 200:
-            parsed = json.loads(response.text)
-            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-            data = response.json()
             print("\nPreview Order:")
 
             if data is not None and "PreviewOrderResponse" in data and "PreviewIds" in data["PreviewOrderResponse"]:
@@ -85,11 +88,7 @@ class Order:
                     print("Preview ID: " + str(previewids["previewId"]))
             else:
                 # Handle errors
-                data = response.json()
-                if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
-                    print("Error: " + data["Error"]["message"])
-                else:
-                    print("Error: Preview Order API service error")
+                print(error_message(data, "Preview Order API service error"))
 
             if data is not None and "PreviewOrderResponse" in data and "Order" in data["PreviewOrderResponse"]:
                 for orders in data["PreviewOrderResponse"]["Order"]:
@@ -121,18 +120,10 @@ class Order:
                     print("Estimated Total Cost: " + str(orders["estimatedTotalAmount"]))
             else:
                 # Handle errors
-                data = response.json()
-                if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
-                    print("Error: " + data["Error"]["message"])
-                else:
-                    print("Error: Preview Order API service error")
+                print(error_message(data, "Preview Order API service error"))
         else:
             # Handle errors
-            data = response.json()
-            if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
-                print("Error: " + data["Error"]["message"])
-            else:
-                print("Error: Preview Order API service error")
+            print(error_message(data, "Preview Order API service error"))
 
     def previous_order(self, session, account, prev_orders):
         """
@@ -205,27 +196,18 @@ class Order:
 
                     # Make API call for POST request
                     response = session.post(url, header_auth=True, headers=headers, data=payload)
-                    logger.debug("Request Header: %s", response.request.headers)
                     logger.debug("Request payload: %s", payload)
 
                     # Handle and parse response
+                    data = decode(response)
                     if response is not None and response.status_code == 200:
-                        parsed = json.loads(response.text)
-                        logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                        data = response.json()
                         print("\nPreview Order: ")
                         if data is not None and "PreviewOrderResponse" in data and "PreviewIds" in data["PreviewOrderResponse"]:
                             for previewids in data["PreviewOrderResponse"]["PreviewIds"]:
                                 print("Preview ID: " + str(previewids["previewId"]))
                         else:
                             # Handle errors
-                            data = response.json()
-                            if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
-                                print("Error: " + data["Error"]["message"])
-                                logger.debug("Response Body: %s", response)
-                            else:
-                                print("Error: Preview Order API service error")
-                                logger.debug("Response Body: %s", response)
+                            print(error_message(data, "Preview Order API service error"))
 
                         if data is not None and "PreviewOrderResponse" in data and "Order" in data[
                             "PreviewOrderResponse"]:
@@ -258,22 +240,10 @@ class Order:
                                 print("Estimated Total Cost: " + str(orders["estimatedTotalAmount"]))
                         else:
                             # Handle errors
-                            data = response.json()
-                            if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
-                                print("Error: " + data["Error"]["message"])
-                                logger.debug("Response Body: %s", response)
-                            else:
-                                print("Error: Preview Order API service error")
-                                logger.debug("Response Body: %s", response)
+                            print(error_message(data, "Preview Order API service error"))
                     else:
                         # Handle errors
-                        data = response.json()
-                        if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
-                            print("Error: " + data["Error"]["message"])
-                            logger.debug("Response Body: %s", response)
-                        else:
-                            print("Error: Preview Order API service error")
-                            logger.debug("Response Body: %s", response)
+                        print(error_message(data, "Preview Order API service error"))
 
                     break
                 elif options_select.isdigit() and int(options_select) == len(prev_orders) + 1:
@@ -282,6 +252,8 @@ class Order:
                     print("Unknown Option Selected!")
 
     @staticmethod
+    @metrics.timed("render", "Order.print_orders")
+    @tracing.span("render", function="Order.print_orders")
     def print_orders(response, status):
         """
         Formats and displays a list of orders
@@ -479,13 +451,10 @@ class Order:
             # Make API call for GET request
             response_open = self.session.get(url, header_auth=True, params=params_open, headers=headers)
 
-            logger.debug("Request Header: %s", response_open.request.headers)
-            logger.debug("Response Body: %s", response_open.text)
-
             print("\nOpen Orders: ")
             # Handle and parse response
+            data = decode(response_open)
             if response_open.status_code == 204:
-                logger.debug(response_open)
                 print("None")
                 menu_items = {"1": "Go Back"}
                 while True:
@@ -501,10 +470,6 @@ class Order:
                         print("Unknown Option Selected!")
                 break
             elif response_open.status_code == 200:
-                parsed = json.loads(response_open.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_open.json()
-
                 order_list = []
                 count = 1
                 if data is not None and "OrdersResponse" in data and "Order" in data["OrdersResponse"]:
@@ -593,37 +558,20 @@ class Order:
 
                         # Add payload for PUT Request
                         response = self.session.put(url, header_auth=True, headers=headers, data=payload)
-                        logger.debug("Request Header: %s", response.request.headers)
                         logger.debug("Request payload: %s", payload)
 
                         # Handle and parse response
-                        if response is not None and response.status_code == 200:
-                            parsed = json.loads(response.text)
-                            logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                            data = response.json()
-                            if data is not None and "CancelOrderResponse" in data \
-                                    and "orderId" in data["CancelOrderResponse"]:
-                                print("\nOrder number #" + str(
-                                    data["CancelOrderResponse"]["orderId"]) + " successfully Cancelled.")
-                            else:
-                                # Handle errors
-                                logger.debug("Response Headers: %s", response.headers)
-                                logger.debug("Response Body: %s", response.text)
-                                data = response.json()
-                                if 'Error' in data and 'message' in data["Error"] \
-                                        and data["Error"]["message"] is not None:
-                                    print("Error: " + data["Error"]["message"])
-                                else:
-                                    print("Error: Cancel Order API service error")
+                        data = decode(response)
+                        if response is not None and response.status_code == 200 and data is not None \
+                                and "CancelOrderResponse" in data and "orderId" in data["CancelOrderResponse"]:
+                            print("\nOrder number #" + str(
+                                data["CancelOrderResponse"]["orderId"]) + " successfully Cancelled.")
+                            # the cached order lists no longer match the account
+                            ordersCache.invalidate()
                         else:
                             # Handle errors
                             logger.debug("Response Headers: %s", response.headers)
-                            logger.debug("Response Body: %s", response.text)
-                            data = response.json()
-                            if 'Error' in data and 'message' in data["Error"] and data["Error"]["message"] is not None:
-                                print("Error: " + data["Error"]["message"])
-                            else:
-                                print("Error: Cancel Order API service error")
+                            print(error_message(data, "Cancel Order API service error"))
                         break
 
                     elif selection.isdigit() and int(selection) == len(order_list) + 1:
@@ -632,159 +580,147 @@ class Order:
                         print("Unknown Option Selected!")
                 else:
                     # Handle errors
-                    logger.debug("Response Body: %s", response_open.text)
-                    if response_open is not None and response_open.headers['Content-Type'] == 'application/json' \
-                            and "Error" in response_open.json() and "message" in response_open.json()["Error"] \
-                            and response_open.json()["Error"]["message"] is not None:
-                        print("Error: " + response_open.json()["Error"]["message"])
-                    else:
-                        print("Error: Balance API service error")
+                    print(error_message(data, "Balance API service error"))
                     break
             else:
                 # Handle errors
-                logger.debug("Response Body: %s", response_open.text)
-                if response_open is not None and response_open.headers['Content-Type'] == 'application/json' \
-                        and "Error" in response_open.json() and "message" in response_open.json()["Error"] \
-                        and response_open.json()["Error"]["message"] is not None:
-                    print("Error: " + response_open.json()["Error"]["message"])
-                else:
-                    print("Error: Balance API service error")
+                print(error_message(data, "Balance API service error"))
                 break
 
-    def view_orders(self):
+    def fetch_orders(self, statuses=None):
         """
-        Calls orders API to provide the details for the orders
+        Calls orders API for each order status in parallel
 
         :param self: Pass in authenticated session and information on selected account
+        :param statuses: list of order statuses to fetch (e.g. ["OPEN", "EXECUTED"]), all statuses if None
+        :return list of ((status, heading, print status), response) tuples in status order
         """
-        while True:
-            # URL for the API endpoint
-            url = self.base_url + "/v1/accounts/" + self.account["accountIdKey"] + "/orders.json"
-
-            # Add parameters and header information
-            headers = {"consumerkey": config["DEFAULT"]["CONSUMER_KEY"]}
-            params_open = {"status": "OPEN"}
-            params_executed = {"status": "EXECUTED"}
-            params_indiv_fills = {"status": "INDIVIDUAL_FILLS"}
-            params_cancelled = {"status": "CANCELLED"}
-            params_rejected = {"status": "REJECTED"}
-            params_expired = {"status": "EXPIRED"}
-
-            # Make API call for GET request
-            response_open = self.session.get(url, header_auth=True, params=params_open, headers=headers)
-            response_executed = self.session.get(url, header_auth=True, params=params_executed, headers=headers)
-            response_indiv_fills = self.session.get(url, header_auth=True, params=params_indiv_fills, headers=headers)
-            response_cancelled = self.session.get(url, header_auth=True, params=params_cancelled, headers=headers)
-            response_rejected = self.session.get(url, header_auth=True, params=params_rejected, headers=headers)
-            response_expired = self.session.get(url, header_auth=True, params=params_expired, headers=headers)
-
-            prev_orders = []
-
-            # Open orders
-            logger.debug("Request Header: %s", response_open.request.headers)
-            logger.debug("Response Body: %s", response_open.text)
-
-            print("\nOpen Orders:")
-            # Handle and parse response
-            if response_open.status_code == 204:
-                logger.debug(response_open)
-                print("None")
-            elif response_open.status_code == 200:
-                parsed = json.loads(response_open.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_open.json()
-
-                # Display list of open orders
-                prev_orders.extend(self.print_orders(data, "open"))
+        selected = [order_status for order_status in ORDER_STATUSES
+                    if statuses is None or order_status[0] in statuses]
+        if len(selected) == 0:
+            return []
+
+        def fetch(status):
+            key = (self.account["accountIdKey"], status)
+            response = ordersCache.get(key, lambda: self.fetch_orders_response(status))
+            if response is None or response.status_code not in (200, 204):
+                # errors are not served from the cache
+                ordersCache.invalidate(key)
+            return response
+
+        # Make API calls for GET requests concurrently, map() keeps results in status order
+        max_workers = min(len(selected), config["DEFAULT"].getint("ORDER_FETCH_WORKERS", fallback=6))
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            responses = list(executor.map(fetch, [order_status[0] for order_status in selected]))
+        return list(zip(selected, responses))
+
+    def fetch_orders_response(self, status):
+        """
+        Calls orders API to retrieve the first page of orders with the given status
 
-            # Executed orders
-            logger.debug("Request Header: %s", response_executed.request.headers)
-            logger.debug("Response Body: %s", response_executed.text)
-            logger.debug(response_executed.text)
+        :param self: Pass in authenticated session and information on selected account
+        :param status: order status to list (e.g. "OPEN")
+        :return response object
+        """
+        # URL for the API endpoint
+        url = self.base_url + "/v1/accounts/" + self.account["accountIdKey"] + "/orders.json"
 
-            print("\nExecuted Orders:")
-            # Handle and parse response
-            if response_executed.status_code == 204:
-                logger.debug(response_executed)
-                print("None")
-            elif response_executed.status_code == 200:
-                parsed = json.loads(response_executed.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_executed.json()
+        # Add parameters and header information
+        params = {"status": status, "count": orders_page_size}
+        headers = {"consumerkey": config["DEFAULT"]["CONSUMER_KEY"]}
 
-                # Display list of executed orders
-                prev_orders.extend(self.print_orders(data, "executed"))
+        # Make API call for GET request
+        return self.session.get(url, header_auth=True, params=params, headers=headers)
 
-            logger.debug("Request Header: %s", response_rejected.request.headers)
-            logger.debug("Response Body: %s", response_rejected.text)
+    def order_pages(self, status, marker=None):
+        """
+        Yields the orders response page by page, prefetching the next page while the current one is processed
 
-            # Individual fills orders
-            logger.debug("Request Header: %s", response_indiv_fills.request.headers)
-            logger.debug("Response Body: %s", response_indiv_fills.text)
+        :param self: Pass in authenticated session and information on selected account
+        :param status: order status to list (e.g. "OPEN")
+        :param marker: marker of the first page to retrieve, the first page of orders if None
+        :return generator of parsed orders responses, raising IncompletePages if a page after the first fails
+        """
+        return prefetched_pages(lambda page_marker: self.fetch_orders_page(status, page_marker), marker,
+                                resumed=marker is not None)
 
-            print("\nIndividual Fills Orders:")
-            # Handle and parse response
-            if response_indiv_fills.status_code == 204:
-                logger.debug("Response Body: %s", response_executed)
-                print("None")
-            elif response_indiv_fills.status_code == 200:
-                parsed = json.loads(response_indiv_fills.text)
-                logger.debug("Response Body: %s", json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_indiv_fills.json()
+    def iter_orders(self, status):
+        """
+        Yields every order with the given status across all pages
 
-                # Display list of individual fills orders
-                prev_orders.extend(self.print_orders(data, "indiv_fills"))
+        :param self: Pass in authenticated session and information on selected account
+        :param status: order status to list (e.g. "OPEN")
+        :return generator of order dicts, raising IncompletePages if a page after the first fails
+        """
+        for page in self.order_pages(status):
+            if "OrdersResponse" in page and "Order" in page["OrdersResponse"]:
+                yield from page["OrdersResponse"]["Order"]
 
-            logger.debug("Request Header: %s", response_rejected.request.headers)
-            logger.debug("Response Body: %s", response_rejected.text)
+    def fetch_orders_page(self, status, marker=None):
+        """
+        Calls orders API to retrieve one page of orders
 
-            # Cancelled orders
-            logger.debug("Request Header: %s", response_cancelled.request.headers)
-            logger.debug("Response Body: %s", response_cancelled.text)
+        :param self: Pass in authenticated session and information on selected account
+        :param status: order status to list (e.g. "OPEN")
+        :param marker: marker returned with the previous page, the first page if None
+        :return tuple of the parsed orders response (None if there are no orders) and the next marker
+        """
+        # URL for the API endpoint
+        url = self.base_url + "/v1/accounts/" + self.account["accountIdKey"] + "/orders.json"
 
-            print("\nCancelled Orders:")
-            # Handle and parse response
-            if response_cancelled.status_code == 204:
-                logger.debug(response_cancelled)
-                print("None")
-            elif response_cancelled.status_code == 200:
-                parsed = json.loads(response_cancelled.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_cancelled.json()
+        # Add parameters and header information
+        headers = {"consumerkey": config["DEFAULT"]["CONSUMER_KEY"]}
+        params = {"status": status, "count": orders_page_size}
+        if marker is not None:
+            params["marker"] = marker
 
-                # Display list of open orders
-                prev_orders.extend(self.print_orders(data, "cancelled"))
+        # Make API call for GET request
+        response = self.session.get(url, header_auth=True, params=params, headers=headers)
 
-            # Rejected orders
-            logger.debug("Request Header: %s", response_rejected.request.headers)
-            logger.debug("Response Body: %s", response_rejected.text)
+        data = decode(response)
+        if response.status_code == 200:
+            return data, self.next_marker(data)
+        return None, None
 
-            print("\nRejected Orders:")
-            # Handle and parse response
-            if response_rejected.status_code == 204:
-                logger.debug(response_executed)
-                print("None")
-            elif response_rejected.status_code == 200:
-                parsed = json.loads(response_executed.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_executed.json()
+    @staticmethod
+    def next_marker(data):
+        """
+        Returns the marker of the page following an orders response, or None on the last page
+        """
+        if data is not None and "OrdersResponse" in data and data["OrdersResponse"].get("marker"):
+            return data["OrdersResponse"]["marker"]
+        return None
 
-                # Display list of open orders
-                prev_orders.extend(self.print_orders(data, "rejected"))
+    def view_orders(self, statuses=None):
+        """
+        Calls orders API to provide the details for the orders
 
-            # Expired orders
-            print("\nExpired Orders:")
-            # Handle and parse response
-            if response_expired.status_code == 204:
-                logger.debug(response_executed)
-                print("None")
-            elif response_expired.status_code == 200:
-                parsed = json.loads(response_expired.text)
-                logger.debug(json.dumps(parsed, indent=4, sort_keys=True))
-                data = response_expired.json()
+        :param self: Pass in authenticated session and information on selected account
+        :param statuses: list of order statuses to display (e.g. ["OPEN"]), all statuses if None
+        """
+        while True:
+            prev_orders = []
 
-                # Display list of open orders
-                prev_orders.extend(self.print_orders(data, "expired"))
+            with tracing.span("view_orders"):
+                for (status, heading, print_status), response in self.fetch_orders(statuses):
+                    print("\n" + heading + ":")
+                    # Handle and parse response
+                    data = decode(response)
+                    if response is not None and response.status_code == 204:
+                        print("None")
+                    elif response is not None and response.status_code == 200:
+                        # Display list of orders, following the marker through any further pages
+                        prev_orders.extend(self.print_orders(data, print_status))
+                        marker = self.next_marker(data)
+                        if marker is not None:
+                            try:
+                                for page in self.order_pages(status, marker):
+                                    prev_orders.extend(self.print_orders(page, print_status))
+                            except IncompletePages as e:
+                                print("Error: Order API service error, the list is incomplete: " + str(e))
+                    else:
+                        # Handle errors
+                        print(error_message(data, "Order API service error"))
 
             menu_list = {"1": "Preview Order",
                          "2": "Cancel Order",
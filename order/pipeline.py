@@ -0,0 +1,268 @@
+"""Preview-then-place pipeline for the orders of a rebalance
+
+The purchase amounts of the rebalancer are split between the weighted symbols of each category
+(securities.purchase_weights) and turned into whole-share market orders at the quoted prices, rounded by
+accounts.allocation.whole_shares so the drift from the targets and the leftover cash stay small. Every order is
+previewed concurrently, its estimate is checked against the quote, and the approved previews are placed
+concurrently. The rate limiter of the session keeps the calls within the orders quota.
+"""
+import configparser
+import logging
+import random
+import string
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from api_response import decode, error_message
+from accounts.allocation import whole_shares
+from accounts.context_cache import portfolioCache, balanceCache, ordersCache
+import securities
+import tracing
+
+# loading configuration file
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# logger, handlers are attached once by log_setup.setup_logging
+logger = logging.getLogger('my_logger')
+
+pipelineWorkers = config["DEFAULT"].getint("ORDER_PIPELINE_WORKERS", fallback=6)
+# largest relative difference between the previewed estimate and the quoted cost of an order
+estimateTolerance = config["DEFAULT"].getfloat("ORDER_ESTIMATE_TOLERANCE", fallback=0.02)
+
+PLANNED = "planned"
+PREVIEWED = "previewed"
+REJECTED = "rejected"
+PLACED = "placed"
+FAILED = "failed"
+# the place request was sent but its outcome is not known, the order may have been placed
+UNKNOWN = "unknown"
+
+ORDER_REQUEST = """<{0}>
+                       <orderType>EQ</orderType>
+                       <clientOrderId>{1}</clientOrderId>{2}
+                       <Order>
+                           <allOrNone>false</allOrNone>
+                           <priceType>MARKET</priceType>
+                           <orderTerm>GOOD_FOR_DAY</orderTerm>
+                           <marketSession>REGULAR</marketSession>
+                           <stopPrice></stopPrice>
+                           <limitPrice></limitPrice>
+                           <Instrument>
+                               <Product>
+                                   <securityType>EQ</securityType>
+                                   <symbol>{3}</symbol>
+                               </Product>
+                               <orderAction>BUY</orderAction>
+                               <quantityType>QUANTITY</quantityType>
+                               <quantity>{4}</quantity>
+                           </Instrument>
+                       </Order>
+                   </{0}>"""
+
+
+def client_order_id(length=20):
+    letters = string.ascii_letters + string.digits
+    return ''.join(random.choice(letters) for i in range(length))
+
+
+class PlannedOrder:
+    """Market buy of whole shares for one account, with the outcome of its preview and placement"""
+    __slots__ = ("accountIdKey", "symbol", "quantity", "price", "amount", "clientOrderId", "status", "previewId",
+                 "estimate", "orderId", "message")
+
+    def __init__(self, accountIdKey, symbol, quantity, price, amount):
+        """
+        :param accountIdKey: account the order is placed in
+        :param quantity: whole shares to buy
+        :param price: quoted price the quantity was computed with
+        :param amount: dollars of the purchase the order stands for
+        """
+        self.accountIdKey = accountIdKey
+        self.symbol = symbol
+        self.quantity = quantity
+        self.price = price
+        self.amount = amount
+        self.clientOrderId = client_order_id()
+        self.status = PLANNED
+        self.previewId = None
+        self.estimate = None
+        self.orderId = None
+        self.message = ""
+
+    @property
+    def cost(self):
+        return self.quantity * self.price
+
+    def to_dict(self):
+        return {"symbol": self.symbol, "quantity": self.quantity, "price": self.price,
+                "amount": round(self.amount, 2), "estimate": self.estimate, "status": self.status,
+                "orderId": self.orderId, "message": self.message}
+
+    def __repr__(self):
+        return "PlannedOrder({!r}, {!r}, quantity={!r}, status={!r})".format(self.accountIdKey, self.symbol,
+                                                                            self.quantity, self.status)
+
+
+def plan_orders(accountIdKey, purchase, prices, weights=None):
+    """
+    Splits the purchase amount of each category between its weighted symbols and rounds them to whole shares
+
+    :param accountIdKey: account the orders are placed in
+    :param purchase: dict of dollars keyed by category, as returned by Rebalancer.rebalance
+    :param prices: dict of quoted prices keyed by symbol, symbols without a price are not bought
+    :param weights: dict of category -> dict of weight keyed by symbol, securities.purchase_weights() by default
+    :return list of PlannedOrder of at least one share
+    """
+    weights = securities.purchase_weights() if weights is None else weights
+    targets = {}
+    for category, amount in purchase.items():
+        symbols = {symbol: weight for symbol, weight in weights.get(category, {}).items() if prices.get(symbol)}
+        total = sum(symbols.values())
+        for symbol, weight in symbols.items():
+            targets[symbol] = targets.get(symbol, 0) + amount * weight / total
+    shares, leftover = whole_shares(targets, prices)
+    logger.debug("Planned %s share(s), %.2f left over", shares, leftover)
+    return [PlannedOrder(accountIdKey, symbol, quantity, prices[symbol], targets[symbol])
+            for symbol, quantity in shares.items() if quantity > 0]
+
+
+class OrderPipeline:
+    def __init__(self, session, base_url, workers=None, tolerance=None):
+        """
+        :param session: authenticated session
+        :param base_url: API base url
+        :param workers: orders previewed or placed at a time, ORDER_PIPELINE_WORKERS by default
+        :param tolerance: ORDER_ESTIMATE_TOLERANCE by default
+        """
+        self.session = session
+        self.base_url = base_url
+        self.workers = workers or pipelineWorkers
+        self.tolerance = estimateTolerance if tolerance is None else tolerance
+
+    def run(self, orders, place=True):
+        """
+        Previews every order concurrently, validates the estimates and places the approved orders concurrently
+
+        :param orders: list of PlannedOrder, of one or more accounts
+        :param place: place the approved orders, otherwise stop after the previews
+        :return orders, with their status updated
+        """
+        if len(orders) == 0:
+            return orders
+        with tracing.span("order_pipeline", orders=len(orders)), \
+                ThreadPoolExecutor(max_workers=max(min(len(orders), self.workers), 1),
+                                   thread_name_prefix="order-pipeline") as executor:
+            list(executor.map(self.preview, orders))
+            approved = [order for order in orders if order.status == PREVIEWED]
+            if place:
+                list(executor.map(self.place, approved))
+        if place:
+            # holdings, cash and open orders changed in every account with a placed order, or possibly placed one
+            for accountIdKey in set(order.accountIdKey for order in orders if order.status in (PLACED, UNKNOWN)):
+                portfolioCache.invalidate(accountIdKey)
+                balanceCache.invalidate(accountIdKey)
+            ordersCache.invalidate()
+        return orders
+
+    def request(self, order, action, payload):
+        # URL for the API endpoint
+        url = self.base_url + "/v1/accounts/" + order.accountIdKey + "/orders/" + action + ".json"
+
+        # Add parameters and header information
+        headers = {"Content-Type": "application/xml", "consumerKey": config["DEFAULT"]["CONSUMER_KEY"]}
+
+        # Make API call for POST request
+        response = self.session.post(url, header_auth=True, headers=headers, data=payload)
+        logger.debug("Request payload: %s", payload)
+        return response, decode(response)
+
+    def preview(self, order):
+        """
+        Calls preview order API and validates the estimate, the order is then previewed or rejected
+        """
+        payload = ORDER_REQUEST.format("PreviewOrderRequest", order.clientOrderId, "", order.symbol, order.quantity)
+        try:
+            response, data = self.request(order, "preview", payload)
+        except Exception as e:
+            order.status, order.message = FAILED, str(e)
+            return order
+        if response is not None and response.status_code == 200 and data is not None \
+                and "PreviewOrderResponse" in data and "PreviewIds" in data["PreviewOrderResponse"]:
+            preview = data["PreviewOrderResponse"]
+            order.previewId = preview["PreviewIds"][0]["previewId"]
+            details = preview.get("Order", [{}])[0]
+            order.estimate = details.get("estimatedTotalAmount")
+            order.status, order.message = self.validate(order, details)
+        else:
+            # Handle errors
+            order.status, order.message = FAILED, error_message(data, "Preview Order API service error")
+        return order
+
+    def validate(self, order, details):
+        """
+        Checks the previewed order against the planned one
+
+        :param details: Order dict of the preview response
+        :return tuple of status and message
+        """
+        instruments = details.get("Instrument", [])
+        if len(instruments) == 0 or instruments[0].get("Product", {}).get("symbol") != order.symbol \
+                or float(instruments[0].get("quantity", 0)) != order.quantity:
+            return REJECTED, "preview does not match the order"
+        if order.estimate is None or order.estimate <= 0:
+            return REJECTED, "no estimated total"
+        commission = details.get("estimatedCommission") or 0
+        if abs(order.estimate - commission - order.cost) > order.cost * self.tolerance:
+            return REJECTED, "estimate {:,.2f} differs from quoted cost {:,.2f}".format(order.estimate, order.cost)
+        return PREVIEWED, ""
+
+    def place(self, order):
+        """
+        Calls place order API with the preview id of a previewed order, the order is then placed or failed, or
+        unknown when the request failed after it may have reached the server
+        """
+        previewIds = """
+                       <PreviewIds>
+                           <previewId>{}</previewId>
+                       </PreviewIds>""".format(order.previewId)
+        payload = ORDER_REQUEST.format("PlaceOrderRequest", order.clientOrderId, previewIds, order.symbol,
+                                       order.quantity)
+        try:
+            response, data = self.request(order, "place", payload)
+        except requests.exceptions.ConnectTimeout as e:
+            # no connection was made, the order never reached the server
+            order.status, order.message = FAILED, str(e)
+            return order
+        except Exception as e:
+            # placing is not idempotent, retrying an order that may have gone through could buy it twice
+            order.status = UNKNOWN
+            order.message = "outcome unknown ({}), check the open orders before placing it again".format(e)
+            return order
+        if response is not None and response.status_code == 200 and data is not None \
+                and "PlaceOrderResponse" in data and "OrderIds" in data["PlaceOrderResponse"]:
+            order.orderId = data["PlaceOrderResponse"]["OrderIds"][0]["orderId"]
+            order.status, order.message = PLACED, ""
+        else:
+            # Handle errors
+            order.status, order.message = FAILED, error_message(data, "Place Order API service error")
+        return order
+
+
+def print_status(orders):
+    """
+    Prints one row per order with its quantity, quoted cost, previewed estimate and outcome
+    """
+    print("{:<22} {:<6} {:>6} {:>10} {:>12} {:>12}  {:<10} {}".format(
+        "Account", "Symbol", "Qty", "Price", "Cost", "Estimate", "Status", "Order ID / Message"))
+    for order in orders:
+        estimate = "{:,.2f}".format(order.estimate) if order.estimate is not None else "-"
+        print("{:<22} {:<6} {:>6} {:>10,.2f} {:>12,.2f} {:>12}  {:<10} {}".format(
+            order.accountIdKey[:22], order.symbol, order.quantity, order.price, order.cost, estimate, order.status,
+            order.orderId if order.orderId is not None else order.message))
+    placed = [order for order in orders if order.status == PLACED]
+    print("{} of {} order(s) placed, {:,.2f} invested".format(len(placed), len(orders),
+                                                             sum(order.cost for order in placed)))
+    unknown = [order for order in orders if order.status == UNKNOWN]
+    if unknown:
+        print("{} order(s) may have been placed, check the open orders before placing them again".format(
+            len(unknown)))
@@ -0,0 +1,37 @@
+from concurrent.futures import ThreadPoolExecutor
+
+
+class IncompletePages(Exception):
+    """A page after the first could not be fetched, the pages already yielded are only part of the result"""
+
+
+def prefetched_pages(fetch_page, first_key=None, resumed=False):
+    """
+    Yields pages one at a time while the following page is already being fetched in the background
+
+    A first page of None ends the iteration without pages (no data or an error already reported by
+    fetch_page). Any later page of None raises IncompletePages, so a partial result is never mistaken for
+    the complete one.
+
+    :param fetch_page: callable taking a page key and returning (page, next key), next key is None on the last page
+    :param first_key: page key of the first page to fetch
+    :param resumed: first_key continues an earlier page, so a failure of the first page fetched raises too
+    :return generator of pages
+    """
+    executor = ThreadPoolExecutor(max_workers=1)
+    try:
+        future = executor.submit(fetch_page, first_key)
+        key = first_key
+        first = not resumed
+        while future is not None:
+            page, next_key = future.result()
+            if page is None:
+                if first:
+                    break
+                raise IncompletePages("page {} could not be retrieved".format(key))
+            first = False
+            future = executor.submit(fetch_page, next_key) if next_key is not None else None
+            key = next_key
+            yield page
+    finally:
+        executor.shutdown(wait=False)
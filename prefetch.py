@@ -0,0 +1,129 @@
+"""Background prefetch of the account context
+
+As soon as the session exists, the prefetcher fetches the account list and then, for every account in parallel,
+its portfolio, balance and open orders into the caches of accounts.context_cache. The account menu then reads
+them without a round trip. Entries are refreshed in the background before they expire, so they stay warm while
+the menus are in use. Enable it with PREFETCH = on in config.ini.
+"""
+import configparser
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from accounts.accounts import Accounts
+from accounts.context_cache import accountListCache, portfolioCache, balanceCache, ordersCache
+from order.order import Order
+
+# loading configuration file
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+logger = logging.getLogger('my_logger')
+
+# entries older than this fraction of their TTL are refreshed ahead of expiry
+REFRESH_AHEAD = 0.75
+
+
+def refresh_if_stale(cache, key, fetch, valid):
+    """
+    Fetches and stores an entry when it is missing or close to expiry
+
+    :param fetch: callable returning the fresh entry
+    :param valid: callable telling whether the fetched entry may be cached
+    :return True if the entry was fetched
+    """
+    age = cache.age(key)
+    if age is not None and age < cache.ttl * REFRESH_AHEAD:
+        return False
+    # an order placed while fetching invalidates the entry, the result fetched before it is then dropped
+    generation = cache.generation(key)
+    data = fetch()
+    if valid(data):
+        cache.put(key, data, generation)
+    return True
+
+
+class Prefetcher:
+    def __init__(self, session, base_url, workers=None, interval=None):
+        """
+        :param session: authenticated session
+        :param base_url: API base url
+        :param workers: accounts prefetched at a time, PREFETCH_WORKERS by default
+        :param interval: seconds between refresh rounds, PREFETCH_INTERVAL by default
+        """
+        self.session = session
+        self.base_url = base_url
+        self.workers = workers or config["DEFAULT"].getint("PREFETCH_WORKERS", fallback=4)
+        self.interval = interval or config["DEFAULT"].getfloat("PREFETCH_INTERVAL", fallback=15)
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        """
+        Starts refreshing the caches from a daemon thread
+        """
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="prefetch", daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                self.refresh()
+            except Exception:
+                # a failed round only costs the menus a live request
+                logger.debug("Prefetch failed", exc_info=True)
+            self.stopped.wait(self.interval)
+
+    def refresh(self):
+        """
+        Refreshes the stale entries of the account list and of every account, accounts in parallel
+
+        :return number of entries fetched
+        """
+        accounts = Accounts(self.session, self.base_url, verbose=False)
+        fetched = refresh_if_stale(accountListCache, self.base_url, accounts.fetchAccounts,
+                                   lambda data: Accounts.openAccounts(data) is not None)
+        accountList = accounts.getAccounts()
+        if accountList is None:
+            return int(fetched)
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="prefetch") as executor:
+            fetched += sum(executor.map(self.refresh_account, accountList))
+        return fetched
+
+    def refresh_account(self, account):
+        """
+        Refreshes the stale portfolio, balance and open orders of one account
+
+        :return number of entries fetched
+        """
+        if self.stopped.is_set():
+            return 0
+        accounts = Accounts(self.session, self.base_url, verbose=False)
+        accounts.account = account
+        key = account["accountIdKey"]
+        fetched = 0
+        if account.get("institutionType") == "BROKERAGE":
+            fetched += refresh_if_stale(portfolioCache, key, accounts.fetchPortfolio,
+                                        lambda data: data is not None)
+        fetched += refresh_if_stale(balanceCache, key, accounts.fetchBalance,
+                                    lambda data: data is not None and "BalanceResponse" in data)
+        order = Order(self.session, account, self.base_url)
+        fetched += refresh_if_stale(ordersCache, (key, "OPEN"), lambda: order.fetch_orders_response("OPEN"),
+                                    lambda response: response is not None and response.status_code in (200, 204))
+        return fetched
+
+
+def start_prefetch(session, base_url, settings):
+    """
+    Starts the background prefetcher if PREFETCH is enabled
+
+    :param settings: config section
+    :return the running Prefetcher, or None
+    """
+    if session is None or not settings.getboolean("PREFETCH", fallback=False):
+        return None
+    return Prefetcher(session, base_url).start()
@@ -0,0 +1,158 @@
+"""Token-bucket request scheduler shared by every API call of a session
+
+Requests are grouped into endpoint classes, each with its own budget of requests per second. An optional total
+budget is shared by all classes; when it is the bottleneck, order requests go before account requests and
+account requests before quotes. Within a class requests are served first come, first served. Requests over
+budget wait for a token instead of failing.
+"""
+import itertools
+import threading
+import time
+
+ORDERS = "orders"
+ACCOUNTS = "accounts"
+MARKET = "market"
+OTHER = "other"
+
+# requests per second, the published E*TRADE quotas
+DEFAULT_BUDGETS = {ORDERS: 2.0, ACCOUNTS: 2.0, MARKET: 4.0}
+# lower is served first when the total budget is short
+PRIORITIES = {ORDERS: 0, ACCOUNTS: 1, MARKET: 2, OTHER: 3}
+
+
+def endpoint_class(path):
+    """
+    Returns the quota class of a URL path: orders, accounts, market or other
+    """
+    if path.startswith("/v1/market/"):
+        return MARKET
+    if path.startswith("/v1/accounts/"):
+        return ORDERS if "/orders" in path else ACCOUNTS
+    return OTHER
+
+
+def parse_budgets(value):
+    """
+    Parses "orders=2,accounts=2,market=4" into a dict of class -> requests per second
+    """
+    budgets = dict(DEFAULT_BUDGETS)
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, rate = item.split("=", 1)
+            budgets[name.strip().lower()] = float(rate)
+    return budgets
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        """
+        :param rate: tokens added per second
+        :param capacity: largest burst, one second worth of tokens by default
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated = clock()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self):
+        """Seconds until a token is available, 0 if one is available now"""
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RequestScheduler:
+    def __init__(self, budgets=None, total=None, burst=None, clock=time.monotonic):
+        """
+        :param budgets: dict of endpoint class -> requests per second, classes not listed are not limited
+        :param total: requests per second shared by all classes, None for no shared limit
+        :param burst: largest burst of every bucket, one second worth of requests by default
+        :param clock: monotonic time source
+        """
+        self.clock = clock
+        self.buckets = {name: TokenBucket(rate, burst, clock) for name, rate in (budgets or DEFAULT_BUDGETS).items()
+                        if rate > 0}
+        self.total = TokenBucket(total, burst, clock) if total else None
+        self.condition = threading.Condition()
+        self.waiting = []
+        self.tickets = itertools.count()
+        self.waits = {}
+
+    def acquire(self, name):
+        """
+        Blocks until a request of the endpoint class may be sent
+
+        :return seconds spent waiting
+        """
+        bucket = self.buckets.get(name)
+        if bucket is None and self.total is None:
+            return 0.0
+        entry = (PRIORITIES.get(name, len(PRIORITIES)), next(self.tickets), name)
+        start = self.clock()
+        with self.condition:
+            self.waiting.append(entry)
+            while True:
+                now = self.clock()
+                delay = self.delay(entry, now)
+                if delay == 0:
+                    break
+                self.condition.wait(delay)
+            self.waiting.remove(entry)
+            if bucket is not None:
+                bucket.tokens -= 1
+            if self.total is not None:
+                self.total.tokens -= 1
+            waited = self.clock() - start
+            count, total = self.waits.get(name, (0, 0.0))
+            self.waits[name] = (count + 1, total + waited)
+            # tokens and the queue changed, waiters recompute their turn
+            self.condition.notify_all()
+        return waited
+
+    def delay(self, entry, now):
+        """
+        Seconds the waiting entry still has to wait, 0 once it is its turn
+        """
+        priority, ticket, name = entry
+        bucket = self.buckets.get(name)
+        if bucket is not None:
+            bucket.refill(now)
+        # first come, first served within a class
+        for other in self.waiting:
+            if other[2] == name and other[1] < ticket:
+                # woken up again once the earlier request is sent
+                return max(bucket.delay() if bucket is not None else 0.0, 0.05)
+        own = bucket.delay() if bucket is not None else 0.0
+        if own > 0 or self.total is None:
+            return own
+        self.total.refill(now)
+        # a higher priority class that only waits for the shared budget goes first
+        for other in self.waiting:
+            if other[0] < priority:
+                otherBucket = self.buckets.get(other[2])
+                if otherBucket is not None:
+                    otherBucket.refill(now)
+                if otherBucket is None or otherBucket.delay() == 0:
+                    return max(self.total.delay(), 0.01)
+        return self.total.delay()
+
+    def penalize(self, name, seconds):
+        """
+        Holds back the endpoint class for seconds, after the server rejected a request for exceeding the quota
+        """
+        with self.condition:
+            bucket = self.buckets.get(name)
+            if bucket is not None:
+                bucket.refill(self.clock())
+                bucket.tokens = min(bucket.tokens, 0) - seconds * bucket.rate
+
+    def stats(self):
+        """
+        :return dict of endpoint class -> (requests, seconds spent waiting)
+        """
+        with self.condition:
+            return dict(self.waits)
@@ -1,4 +1,135 @@
-US_STOCKS = ['VTI', 'AKREX', 'GTLOX', 'GSIHX', 'RPD',
-             'JETS', 'BAC', 'BUFTX', 'GM', 'GPRO', 'XTN', 'VGT', 'VYM', 'VNO']
-BONDS = ['CPTNX', 'VIPSX', 'BND']
-INTL_STOCKS = ['VEU', 'VWO']
+"""Classification of symbols into the asset classes used by the rebalancer
+
+The table is compiled once into a read-only symbol -> category dict. Set SECURITIES_FILE in config.ini to a
+CSV file with "symbol,category" rows to replace the default table without code edits. An optional "weight"
+column names the symbols the monthly purchase buys and how a category's amount is split between them.
+"""
+import configparser
+import csv
+from types import MappingProxyType
+
+# loading configuration file
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+US_STOCK_CATEGORY = "US Stock"
+BONDS_CATEGORY = "Bonds"
+INTL_STOCK_CATEGORY = "International Stock"
+
+# default table, used when no SECURITIES_FILE is configured
+DEFAULT_TABLE = {
+    US_STOCK_CATEGORY: ['VTI', 'AKREX', 'GTLOX', 'GSIHX', 'RPD',
+                        'JETS', 'BAC', 'BUFTX', 'GM', 'GPRO', 'XTN', 'VGT', 'VYM', 'VNO'],
+    BONDS_CATEGORY: ['CPTNX', 'VIPSX', 'BND'],
+    INTL_STOCK_CATEGORY: ['VEU', 'VWO'],
+}
+
+# symbols bought by the monthly purchase and their share of their category, used with the default table
+DEFAULT_WEIGHTS = {'VTI': 1, 'BND': 1, 'VEU': 0.75, 'VWO': 0.25}
+
+CATEGORY_BY_SYMBOL = MappingProxyType({})
+CATEGORIES = ()
+WEIGHT_BY_SYMBOL = MappingProxyType({})
+# symbol lists of the three default categories, derived from the loaded table on every reload
+US_STOCKS = []
+BONDS = []
+INTL_STOCKS = []
+
+
+def compile_table(rows):
+    """
+    Builds the read-only symbol -> category index
+
+    :param rows: iterable of (symbol, category) pairs
+    :return tuple of the index and the categories in order of first appearance
+    """
+    index = {}
+    categories = []
+    for symbol, category in rows:
+        index[symbol.strip().upper()] = category.strip()
+        if category.strip() not in categories:
+            categories.append(category.strip())
+    return MappingProxyType(index), tuple(categories)
+
+
+def read_table(path):
+    """
+    Reads a classification file with a "symbol,category" header and an optional "weight" column
+
+    :return tuple of the list of (symbol, category) pairs and the dict of weights keyed by symbol
+    """
+    with open(path, newline="") as f:
+        rows = [row for row in csv.DictReader(f) if row.get("symbol")]
+    weights = {row["symbol"].strip().upper(): float(row["weight"]) for row in rows
+               if (row.get("weight") or "").strip()}
+    return [(row["symbol"], row["category"]) for row in rows], weights
+
+
+def reload(path=None):
+    """
+    Replaces the classification table with the one in path, or the default table if path is None
+    """
+    global CATEGORY_BY_SYMBOL, CATEGORIES, WEIGHT_BY_SYMBOL, US_STOCKS, BONDS, INTL_STOCKS
+    if path:
+        rows, weights = read_table(path)
+    else:
+        rows = [(symbol, category) for category, symbols in DEFAULT_TABLE.items() for symbol in symbols]
+        weights = DEFAULT_WEIGHTS
+    CATEGORY_BY_SYMBOL, CATEGORIES = compile_table(rows)
+    WEIGHT_BY_SYMBOL = MappingProxyType({symbol: weight for symbol, weight in weights.items() if weight > 0})
+    US_STOCKS = symbols_in(US_STOCK_CATEGORY)
+    BONDS = symbols_in(BONDS_CATEGORY)
+    INTL_STOCKS = symbols_in(INTL_STOCK_CATEGORY)
+
+
+def category_of(symbol):
+    return CATEGORY_BY_SYMBOL.get(symbol)
+
+
+def symbols():
+    return list(CATEGORY_BY_SYMBOL)
+
+
+def symbols_in(category):
+    return [symbol for symbol, symbolCategory in CATEGORY_BY_SYMBOL.items() if symbolCategory == category]
+
+
+def purchase_weights():
+    """
+    Groups the weighted symbols by category
+
+    :return dict of category -> dict of weight keyed by symbol, only categories with a weighted symbol
+    """
+    weights = {}
+    for symbol, weight in WEIGHT_BY_SYMBOL.items():
+        category = CATEGORY_BY_SYMBOL.get(symbol)
+        if category is not None:
+            weights.setdefault(category, {})[symbol] = weight
+    return weights
+
+
+def category_totals(holdings):
+    """
+    Sums the market value of the holdings of each category in a single pass
+
+    :param holdings: dict of Position keyed by symbol
+    :return dict of market value keyed by category, every category included
+    """
+    index = CATEGORY_BY_SYMBOL
+    totals = dict.fromkeys(CATEGORIES, 0)
+    for symbol, position in holdings.items():
+        category = index.get(symbol)
+        if category is not None:
+            totals[category] += position.marketValue
+    return totals
+
+
+def uncategorized(holdings):
+    """
+    Lists the symbols of the holdings that are not in the classification table
+    """
+    index = CATEGORY_BY_SYMBOL
+    return [symbol for symbol in holdings if symbol not in index]
+
+
+reload(config["DEFAULT"].get("SECURITIES_FILE"))
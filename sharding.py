@@ -0,0 +1,144 @@
+"""Rebalance of many accounts sharded across a process pool
+
+The coordinator fetches the account list, splits the selected accounts into shards and hands them to worker
+processes. Each worker rebuilds an authenticated session from the stored access token, fetches and rebalances
+its shards, and returns compact JSON-ready results that are written out as soon as each shard completes.
+Parsing and allocation run in every worker, so throughput grows with the number of cores instead of being
+bound by the GIL of a single process.
+"""
+import asyncio
+import configparser
+import json
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from rauth import OAuth1Service
+import rate_limit
+import token_store
+import transport
+from accounts.accounts import Accounts, Rebalancer
+import batch
+import metrics
+
+# loading configuration file
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+# accounts per shard; small shards spread the load evenly and let results stream back early
+shardSize = config["DEFAULT"].getint("SHARD_SIZE", fallback=10)
+
+# session of the worker process, built once by init_worker
+workerSession = None
+workerBaseUrl = None
+
+
+def shards(accounts, size):
+    return [accounts[start:start + size] for start in range(0, len(accounts), size)]
+
+
+def worker_settings(settings, processes):
+    """
+    Splits the rate limit budgets between the workers, so together they stay within the account's quotas
+    """
+    # configparser lowercases keys, the plain dict sent to the workers keeps them as written in config.ini
+    settings = {key.upper(): value for key, value in settings.items()}
+    limits = settings.get("RATE_LIMITS", "")
+    if limits.lower() != "off":
+        budgets = rate_limit.parse_budgets(limits)
+        settings["RATE_LIMITS"] = ",".join("{}={}".format(name, rate / processes) for name, rate in budgets.items())
+        if settings.get("RATE_LIMIT_TOTAL"):
+            settings["RATE_LIMIT_TOTAL"] = str(float(settings["RATE_LIMIT_TOTAL"]) / processes)
+    return settings
+
+
+def init_worker(settings, tokenFile, base_url, devMode):
+    """
+    Rebuilds the authenticated session in a worker process from the stored access token
+
+    :param settings: config section of the coordinator, with the rate limits already split
+    :param tokenFile: stored access token
+    :param base_url: API base url
+    :param devMode: replay responses and fakeData.json, as the coordinator does
+    """
+    global workerSession, workerBaseUrl
+    service = OAuth1Service(name="etrade",
+                            consumer_key=settings["CONSUMER_KEY"],
+                            consumer_secret=settings["CONSUMER_SECRET"],
+                            base_url="https://api.etrade.com")
+    if transport.is_offline(settings, devMode):
+        workerSession = service.get_session(("offline", "offline"))
+    else:
+        token = token_store.load_token(tokenFile)
+        if token is None:
+            raise RuntimeError("no stored access token in " + tokenFile)
+        workerSession = service.get_session((token["access_token"], token["access_token_secret"]))
+    workerBaseUrl = base_url
+    transport.configure_session(workerSession, settings, devMode)
+
+
+def rebalance_shard(accounts, dry_run):
+    """
+    Fetches and rebalances one shard of accounts in a worker process, placing its orders unless dry_run
+
+    :param accounts: account dicts of the shard
+    :return tuple of the list of JSON-ready results, one per account, and the metrics recorded for the shard
+    """
+    fetched = asyncio.run(batch.fetch_selected(workerSession, workerBaseUrl, accounts))
+    rebalanced = [(result, holdings) for result, holdings in fetched if holdings is not None]
+    purchases = Rebalancer.rebalanceAccounts([holdings for result, holdings in rebalanced])
+    for (result, holdings), purchase in zip(rebalanced, purchases):
+        result["purchase"] = purchase
+    batch.order_purchases(workerSession, workerBaseUrl, [result for result, holdings in rebalanced], dry_run)
+    return [result for result, holdings in fetched], metrics.REGISTRY.take()
+
+
+def run_sharded_rebalance(session, base_url, selectors, dry_run, output, processes, tokenFile, devMode=False):
+    """
+    Rebalances the selected accounts across a pool of worker processes and writes the results as JSON
+
+    The allocation of every account only depends on its own holdings, so rebalancing shard by shard gives the
+    same purchases as a single allocation over all accounts.
+
+    :param session: authenticated session of the coordinator, used for the account list
+    :param processes: number of worker processes, the number of cores if 0
+    :param tokenFile: stored access token the workers authenticate with
+    :param devMode: the coordinator runs in devMode, workers do the same
+    :return 0 if every account was rebalanced, 1 otherwise
+    """
+    accounts = Accounts(session, base_url).getAccounts()
+    if accounts is None:
+        return 1
+    selected = batch.select_accounts(accounts, selectors)
+    processes = processes or os.cpu_count() or 1
+    size = max(min(shardSize, math.ceil(len(selected) / processes)), 1)
+
+    errors = 0
+    count = 0
+    # spawned workers do not inherit the logging and metrics threads of the coordinator
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=init_worker,
+                             initargs=(worker_settings(config["DEFAULT"], processes), tokenFile, base_url,
+                                       devMode)) as executor, open(output, "w") as f:
+        futures = {executor.submit(rebalance_shard, shard, dry_run): shard for shard in shards(selected, size)}
+        f.write('{{"dryRun": {}, "accounts": ['.format(json.dumps(dry_run)))
+        try:
+            for future in as_completed(futures):
+                try:
+                    results, shardMetrics = future.result()
+                    metrics.REGISTRY.merge(shardMetrics)
+                except Exception as e:
+                    # the other shards keep running, every account of this one is recorded as failed
+                    message = "shard failed, its orders may be incomplete: {!r}".format(e)
+                    results = [{"accountId": account.get("accountId"), "accountIdKey": account.get("accountIdKey"),
+                                "error": message} for account in futures[future]]
+                for result in results:
+                    f.write(",\n" if count > 0 else "\n")
+                    json.dump(result, f)
+                    count += 1
+                    errors += 1 if "error" in result else 0
+        finally:
+            # the file stays valid JSON even if writing the results is interrupted
+            f.write("\n]}\n")
+    print("Rebalanced {} account(s) in {} process(es), results written to {}".format(count, processes, output))
+    return 1 if errors else 0
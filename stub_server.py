@@ -0,0 +1,271 @@
+"""Local stand-in for the E*TRADE endpoints used by this client, for load and latency testing
+
+    python stub_server.py --port 8800 --latency-ms 80 --error-rate 0.01 --positions 2000 --page-size 50
+
+Responses follow the schema of fakeData.json. Point Accounts, Order and Market at the server with
+base_url = "http://localhost:8800"; OAuth headers are accepted and ignored.
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+import synthetic_data
+
+# quote API accepts 25 symbols per request, or 50 when overrideSymbolCount is set
+MAX_QUOTE_SYMBOLS = 25
+MAX_QUOTE_SYMBOLS_OVERRIDE = 50
+
+
+class StubData:
+    def __init__(self, accounts, positions, orders, seed=0, lots=1):
+        """
+        Builds the accounts, portfolios and orders served by the stub, the same for a given seed
+
+        :param accounts: number of brokerage accounts
+        :param positions: number of positions per account
+        :param orders: number of orders per account
+        :param lots: number of tax lots per position
+        """
+        self.lots = lots
+        self.accounts = []
+        self.portfolios = {}
+        self.orders = {}
+        self.nextId = 1000
+        self.lock = threading.Lock()
+        for index in range(accounts):
+            account = synthetic_data.make_account(index)
+            accountIdKey = account["accountIdKey"]
+            self.accounts.append(account)
+            self.portfolios[accountIdKey] = list(synthetic_data.iter_positions(
+                accountIdKey, positions, lots, seed=seed * 100003 + index))
+            self.orders[accountIdKey] = list(synthetic_data.iter_orders(orders, seed=seed * 100003 + index))
+
+    def newId(self):
+        with self.lock:
+            self.nextId += 1
+            return self.nextId
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "EtradeStub/1.0"
+
+    ROUTES = [("GET", re.compile(r"^/v1/accounts/list\.json$"), "account_list"),
+              ("GET", re.compile(r"^/v1/accounts/([^/]+)/portfolio\.json$"), "portfolio"),
+              ("GET", re.compile(r"^/v1/accounts/([^/]+)/portfolio/(\d+)$"), "position_lots"),
+              ("GET", re.compile(r"^/v1/accounts/([^/]+)/balance\.json$"), "balance"),
+              ("GET", re.compile(r"^/v1/accounts/([^/]+)/orders\.json$"), "orders"),
+              ("POST", re.compile(r"^/v1/accounts/([^/]+)/orders/preview(?:\.json)?$"), "preview"),
+              ("POST", re.compile(r"^/v1/accounts/([^/]+)/orders/place(?:\.json)?$"), "place"),
+              ("PUT", re.compile(r"^/v1/accounts/([^/]+)/orders/cancel\.json$"), "cancel"),
+              ("GET", re.compile(r"^/v1/market/quote/([^/]+)\.json$"), "quote"),
+              ("GET", re.compile(r"^/oauth/renew_access_token$"), "renew")]
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_PUT(self):
+        self.dispatch("PUT")
+
+    def dispatch(self, method):
+        options = self.server.options
+        url = urlsplit(self.path)
+        self.query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length).decode("utf-8", "replace") if length else ""
+
+        latency = options.latency_ms + random.uniform(-options.jitter_ms, options.jitter_ms)
+        if latency > 0:
+            time.sleep(latency / 1000)
+        if random.random() < options.error_rate:
+            return self.send_json(500, {"Error": {"code": 100, "message": "Simulated service error"}})
+
+        for routeMethod, pattern, name in self.ROUTES:
+            match = pattern.match(url.path)
+            if routeMethod == method and match:
+                return getattr(self, "handle_" + name)(*match.groups())
+        self.send_json(404, {"Error": {"code": 404, "message": "Unknown endpoint " + url.path}})
+
+    def account(self, accountIdKey):
+        if accountIdKey not in self.server.data.portfolios:
+            self.send_json(400, {"Error": {"code": 1003, "message": "Invalid account key " + accountIdKey}})
+            return False
+        return True
+
+    def handle_account_list(self):
+        self.send_json(200, {"AccountListResponse": {"Accounts": {"Account": self.server.data.accounts}}})
+
+    def handle_portfolio(self, accountIdKey):
+        if not self.account(accountIdKey):
+            return
+        positions = self.server.data.portfolios[accountIdKey]
+        if len(positions) == 0:
+            return self.send_json(204, None)
+        pageSize = max(min(int(self.query.get("count", 50)), self.server.options.page_size), 1)
+        pageNumber = max(int(self.query.get("pageNumber", 1)), 1)
+        totalPages = (len(positions) + pageSize - 1) // pageSize
+        page = positions[(pageNumber - 1) * pageSize:pageNumber * pageSize]
+        accountPortfolio = {"accountId": accountIdKey, "totalPages": totalPages, "Position": page}
+        if pageNumber < totalPages:
+            accountPortfolio["nextPageNo"] = str(pageNumber + 1)
+        self.send_json(200, {"PortfolioResponse": {"AccountPortfolio": [accountPortfolio]}})
+
+    def handle_position_lots(self, accountIdKey, positionId):
+        if not self.account(accountIdKey):
+            return
+        for position in self.server.data.portfolios[accountIdKey]:
+            if position["positionId"] == int(positionId):
+                return self.send_json(200, synthetic_data.position_lots_response(
+                    position["symbolDescription"], position["positionId"], self.server.data.lots))
+        self.send_json(400, {"Error": {"code": 1004, "message": "Invalid position id " + positionId}})
+
+    def handle_balance(self, accountIdKey):
+        if not self.account(accountIdKey):
+            return
+        total = sum(position["marketValue"] for position in self.server.data.portfolios[accountIdKey])
+        self.send_json(200, {"BalanceResponse": {
+            "accountId": accountIdKey,
+            "accountDescription": "Stub account",
+            "Computed": {"cashBuyingPower": 10000.0, "marginBuyingPower": 20000.0,
+                         "RealTimeValues": {"totalAccountValue": round(total + 10000.0, 2)}}}})
+
+    def handle_orders(self, accountIdKey):
+        if not self.account(accountIdKey):
+            return
+        status = self.query.get("status")
+        orders = [order for order in self.server.data.orders[accountIdKey]
+                  if status is None or order["OrderDetail"][0]["status"] == status]
+        count = max(min(int(self.query.get("count", 25)), 100), 1)
+        start = int(self.query.get("marker", 0))
+        page = orders[start:start + count]
+        if len(page) == 0:
+            return self.send_json(204, None)
+        response = {"Order": page}
+        if start + count < len(orders):
+            response["marker"] = str(start + count)
+            response["next"] = "/v1/accounts/{}/orders.json?marker={}".format(accountIdKey, start + count)
+        self.send_json(200, {"OrdersResponse": response})
+
+    def order_request(self):
+        """Reads symbol, action, quantity and price type from an XML or JSON order request body"""
+        fields = {}
+        for field, default in (("symbol", ""), ("orderAction", "BUY"), ("quantity", "0"), ("priceType", "MARKET")):
+            match = re.search(r'<{0}>\s*([^<\s]+)\s*</{0}>|"{0}"\s*:\s*"?([^",}}\s]+)'.format(field), self.body)
+            fields[field] = (match.group(1) or match.group(2)) if match else default
+        fields["quantity"] = float(fields["quantity"])
+        return fields
+
+    def order_details(self, fields):
+        estimated = round(synthetic_data.price_of(fields["symbol"]) * fields["quantity"], 2)
+        return [{"priceType": fields["priceType"], "orderTerm": "GOOD_FOR_DAY", "limitPrice": 0,
+                 "estimatedCommission": 0, "estimatedTotalAmount": estimated,
+                 "Instrument": [{"Product": {"securityType": "EQ", "symbol": fields["symbol"]},
+                                 "orderAction": fields["orderAction"], "quantity": fields["quantity"],
+                                 "symbolDescription": fields["symbol"]}]}]
+
+    def handle_preview(self, accountIdKey):
+        if not self.account(accountIdKey):
+            return
+        fields = self.order_request()
+        if fields["symbol"] == "" or fields["quantity"] <= 0:
+            return self.send_json(400, {"Error": {"code": 1019, "message": "Invalid symbol or quantity"}})
+        self.send_json(200, {"PreviewOrderResponse": {
+            "orderType": "EQ",
+            "PreviewIds": [{"previewId": self.server.data.newId()}],
+            "Order": self.order_details(fields)}})
+
+    def handle_place(self, accountIdKey):
+        if not self.account(accountIdKey):
+            return
+        fields = self.order_request()
+        if re.search(r"previewId", self.body) is None:
+            return self.send_json(400, {"Error": {"code": 1033, "message": "Missing preview id"}})
+        self.send_json(200, {"PlaceOrderResponse": {
+            "orderType": "EQ",
+            "OrderIds": [{"orderId": self.server.data.newId()}],
+            "Order": self.order_details(fields)}})
+
+    def handle_cancel(self, accountIdKey):
+        if not self.account(accountIdKey):
+            return
+        match = re.search(r"<orderId>\s*(\d+)\s*</orderId>|\"orderId\"\s*:\s*(\d+)", self.body)
+        if match is None:
+            return self.send_json(400, {"Error": {"code": 5001, "message": "Missing order id"}})
+        self.send_json(200, {"CancelOrderResponse": {"orderId": int(match.group(1) or match.group(2))}})
+
+    def handle_quote(self, symbols):
+        symbols = [symbol for symbol in symbols.split(",") if symbol]
+        limit = MAX_QUOTE_SYMBOLS_OVERRIDE if self.query.get("overrideSymbolCount") == "true" else MAX_QUOTE_SYMBOLS
+        if len(symbols) > limit:
+            return self.send_json(200, {"QuoteResponse": {"Messages": {"Message": [
+                {"description": "Too many symbols, the limit is {}".format(limit), "code": 1002, "type": "ERROR"}]}}})
+        self.send_json(200, synthetic_data.quote_response(symbol.upper() for symbol in symbols))
+
+    def handle_renew(self):
+        body = b"Access Token has been renewed"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, status, data):
+        body = json.dumps(data).encode("utf-8") if data is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.options.verbose:
+            super().log_message(format, *args)
+
+
+def create_server(options):
+    """
+    Creates the stub server without starting it
+
+    :param options: parsed command line options, see parse_args
+    :return ThreadingHTTPServer, serve_forever() starts it
+    """
+    server = ThreadingHTTPServer((options.host, options.port), StubHandler)
+    server.daemon_threads = True
+    server.options = options
+    server.data = StubData(options.accounts, options.positions, options.orders, options.seed,
+                             options.lots)
+    return server
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local stand-in for the E*TRADE API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8800)
+    parser.add_argument("--latency-ms", type=float, default=0, help="delay added to every response")
+    parser.add_argument("--jitter-ms", type=float, default=0, help="random +/- variation of the delay")
+    parser.add_argument("--error-rate", type=float, default=0, help="fraction of requests answered with a 500")
+    parser.add_argument("--accounts", type=int, default=3)
+    parser.add_argument("--positions", type=int, default=20, help="positions per account")
+    parser.add_argument("--lots", type=int, default=1, help="tax lots per position")
+    parser.add_argument("--orders", type=int, default=40, help="orders per account")
+    parser.add_argument("--page-size", type=int, default=50, help="largest portfolio page served")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true", help="log every request")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    options = parse_args()
+    server = create_server(options)
+    print("Serving the E*TRADE stub on http://{}:{}".format(options.host, options.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,251 @@
+"""Synthetic E*TRADE payloads for scale testing
+
+Builds AccountListResponse, PortfolioResponse, OrdersResponse and QuoteResponse payloads in the schema of
+fakeData.json, with symbols from securities.py mixed with uncategorized noise. The write_* functions stream
+each payload element by element, so very large outputs never have to fit in memory:
+
+    python synthetic_data.py portfolio --accounts 4 --positions 100000 --lots 2 --output portfolio.json
+"""
+import argparse
+import json
+import random
+import sys
+import time
+import securities
+
+# symbols outside the classification table, so uncategorized holdings show up too
+NOISE_SYMBOLS = ["MSC", "AAPL", "TSLA", "XOM", "KO", "PFE", "T", "F"]
+ORDER_STATUSES = ["OPEN", "EXECUTED", "INDIVIDUAL_FILLS", "CANCELLED", "REJECTED", "EXPIRED"]
+
+
+def price_of(symbol):
+    """Deterministic price of a symbol, the same in every payload"""
+    return round(random.Random(symbol).uniform(10, 400), 2)
+
+
+def position_symbols(count, noise=0.1, seed=0):
+    """
+    Yields count distinct symbols, a noise fraction of them outside the classification table
+
+    Once the table is exhausted symbols repeat with a numeric suffix so every position stays distinct.
+    """
+    rnd = random.Random(seed)
+    universe = securities.symbols()
+    for i in range(count):
+        if rnd.random() < noise or len(universe) == 0:
+            base, cycle = NOISE_SYMBOLS[i % len(NOISE_SYMBOLS)], i // len(NOISE_SYMBOLS)
+        else:
+            base, cycle = universe[i % len(universe)], i // len(universe)
+        yield base if cycle == 0 else "{}{}".format(base, cycle)
+
+
+def make_account(index):
+    return {"accountId": str(84000000 + index),
+            "accountIdKey": "synthKey{}".format(index),
+            "accountMode": "CASH",
+            "accountDesc": "Synthetic account {}".format(index),
+            "accountName": "",
+            "accountType": "INDIVIDUAL",
+            "institutionType": "BROKERAGE",
+            "accountStatus": "ACTIVE",
+            "closedDate": 0}
+
+
+def make_lots(symbol, positionId, lots=1):
+    """
+    Builds the tax lots of a position, seeded by the position id so the lots endpoint can rebuild them
+    """
+    rnd = random.Random(positionId)
+    price = price_of(symbol)
+    result = []
+    for index in range(lots):
+        quantity = rnd.randint(1, 500 // lots + 1)
+        pricePaid = round(price * rnd.uniform(0.6, 1.2), 2)
+        result.append({"positionLotId": positionId * 100 + index,
+                       "price": pricePaid,
+                       "originalQty": quantity,
+                       "remainingQty": quantity,
+                       "acquiredDate": 1500000000000 + index * 86400000,
+                       "marketValue": round(price * quantity, 2),
+                       "totalCost": round(pricePaid * quantity, 2),
+                       "totalCostForGainPct": round(pricePaid * quantity, 2),
+                       "legNo": 1,
+                       "exchangeCode": "",
+                       "lotSourceCode": 0,
+                       "daysGain": round(price * quantity * 0.01, 2),
+                       "daysGainPct": 1.0,
+                       "termCode": 1})
+    return result
+
+
+def make_position(rnd, symbol, positionId, accountIdKey, lots=1):
+    price = price_of(symbol)
+    lotList = make_lots(symbol, positionId, lots)
+    quantity = sum(lot["remainingQty"] for lot in lotList)
+    totalCost = round(sum(lot["totalCost"] for lot in lotList), 2)
+    pricePaid = round(totalCost / quantity, 2)
+    marketValue = round(price * quantity, 2)
+    return {"Product": {"expiryDay": 0, "expiryMonth": 0, "expiryYear": 0,
+                        "securityType": "EQ", "strikePrice": 0, "symbol": symbol},
+            "Quick": {"change": round(price * 0.01, 2), "changePct": 1.0, "lastTrade": price,
+                      "lastTradeTime": int(time.time()), "volume": rnd.randint(1000, 1000000)},
+            "commissions": 0,
+            "costPerShare": pricePaid,
+            "dateAcquired": lotList[0]["acquiredDate"],
+            "daysGain": round(quantity * price * 0.01, 2),
+            "daysGainPct": 1.0,
+            "lotsDetails": "/v1/accounts/{}/portfolio/{}".format(accountIdKey, positionId),
+            "marketValue": marketValue,
+            "otherFees": 0,
+            "pctOfPortfolio": round(rnd.uniform(0, 0.01), 4),
+            "positionId": positionId,
+            "positionIndicator": "TYPE2",
+            "positionType": "LONG",
+            "pricePaid": pricePaid,
+            "quantity": quantity,
+            "quoteDetails": "/v1/market/quote/" + symbol,
+            "symbolDescription": symbol,
+            "todayCommissions": 0,
+            "todayFees": 0,
+            "todayPricePaid": 0,
+            "todayQuantity": 0,
+            "totalCost": totalCost,
+            "totalGain": round(marketValue - totalCost, 2),
+            "totalGainPct": round((marketValue - totalCost) / totalCost * 100, 2)}
+
+
+def make_order(rnd, orderId, symbol, status):
+    price = price_of(symbol)
+    quantity = rnd.randint(1, 100)
+    return {"orderId": orderId,
+            "orderType": "EQ",
+            "OrderDetail": [{"priceType": "LIMIT",
+                             "orderTerm": "GOOD_FOR_DAY",
+                             "limitPrice": price,
+                             "status": status,
+                             "Instrument": [{"Product": {"securityType": "EQ", "symbol": symbol},
+                                             "orderAction": rnd.choice(["BUY", "SELL"]),
+                                             "orderedQuantity": quantity,
+                                             "filledQuantity": quantity if status == "EXECUTED" else 0,
+                                             "averageExecutionPrice": price}]}]}
+
+
+def make_quote(symbol):
+    price = price_of(symbol)
+    return {"dateTime": time.strftime("%H:%M:%S EDT %m-%d-%Y"),
+            "Product": {"securityType": "EQ", "symbol": symbol},
+            "All": {"lastTrade": price, "changeClose": round(price * 0.01, 2), "changeClosePercentage": 1.0,
+                    "open": price, "previousClose": round(price * 0.99, 2),
+                    "bid": round(price - 0.01, 2), "bidSize": 100, "ask": round(price + 0.01, 2), "askSize": 100,
+                    "low": round(price * 0.98, 2), "high": round(price * 1.02, 2), "totalVolume": 1000000}}
+
+
+def iter_positions(accountIdKey, positions, lots=1, noise=0.1, seed=0):
+    """
+    Yields the positions of one account, each symbol bought in lots separate tax lots
+    """
+    rnd = random.Random(seed)
+    for index, symbol in enumerate(position_symbols(positions, noise, seed)):
+        yield make_position(rnd, symbol, 27000000 + index, accountIdKey, lots)
+
+
+def iter_orders(orders, statuses=ORDER_STATUSES, noise=0.1, seed=0):
+    rnd = random.Random(seed)
+    symbols = list(position_symbols(min(orders, 500), noise, seed)) or NOISE_SYMBOLS
+    for i in range(orders):
+        yield make_order(rnd, 500 + i, rnd.choice(symbols), rnd.choice(statuses))
+
+
+def account_list_response(accounts):
+    return {"AccountListResponse": {"Accounts": {"Account": [make_account(index) for index in range(accounts)]}}}
+
+
+def portfolio_response(accounts=1, positions=10, lots=1, noise=0.1, seed=0):
+    return {"PortfolioResponse": {"AccountPortfolio": [
+        {"accountId": make_account(index)["accountId"], "totalPages": 1,
+         "Position": list(iter_positions(make_account(index)["accountIdKey"], positions, lots, noise, seed + index))}
+        for index in range(accounts)]}}
+
+
+def orders_response(orders, statuses=ORDER_STATUSES, noise=0.1, seed=0):
+    return {"OrdersResponse": {"Order": list(iter_orders(orders, statuses, noise, seed))}}
+
+
+def position_lots_response(symbol, positionId, lots=1):
+    return {"PositionLotsResponse": {"PositionLot": make_lots(symbol, positionId, lots)}}
+
+
+def quote_response(symbols):
+    return {"QuoteResponse": {"QuoteData": [make_quote(symbol) for symbol in symbols]}}
+
+
+def write_array(f, items):
+    """Writes a JSON array one element at a time"""
+    f.write("[")
+    for index, item in enumerate(items):
+        if index > 0:
+            f.write(",")
+        json.dump(item, f)
+    f.write("]")
+
+
+def write_portfolio(f, accounts=1, positions=10, lots=1, noise=0.1, seed=0):
+    f.write('{"PortfolioResponse": {"AccountPortfolio": [')
+    for index in range(accounts):
+        account = make_account(index)
+        if index > 0:
+            f.write(",")
+        f.write('{{"accountId": {}, "totalPages": 1, "Position": '.format(json.dumps(account["accountId"])))
+        write_array(f, iter_positions(account["accountIdKey"], positions, lots, noise, seed + index))
+        f.write("}")
+    f.write("]}}")
+
+
+def write_orders(f, orders, statuses=ORDER_STATUSES, noise=0.1, seed=0):
+    f.write('{"OrdersResponse": {"Order": ')
+    write_array(f, iter_orders(orders, statuses, noise, seed))
+    f.write("}}")
+
+
+def write_quotes(f, symbols):
+    f.write('{"QuoteResponse": {"QuoteData": ')
+    write_array(f, (make_quote(symbol) for symbol in symbols))
+    f.write("}}")
+
+
+def write_account_list(f, accounts):
+    f.write('{"AccountListResponse": {"Accounts": {"Account": ')
+    write_array(f, (make_account(index) for index in range(accounts)))
+    f.write("}}}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate synthetic E*TRADE payloads")
+    parser.add_argument("kind", choices=["accounts", "portfolio", "orders", "quotes"])
+    parser.add_argument("--accounts", type=int, default=1)
+    parser.add_argument("--positions", type=int, default=10, help="positions per account")
+    parser.add_argument("--lots", type=int, default=1, help="tax lots per position")
+    parser.add_argument("--orders", type=int, default=10)
+    parser.add_argument("--symbols", type=int, default=25, help="symbols in a quote response")
+    parser.add_argument("--noise", type=float, default=0.1, help="fraction of uncategorized symbols")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="file to write, standard output if omitted")
+    args = parser.parse_args(argv)
+
+    f = open(args.output, "w") if args.output else sys.stdout
+    try:
+        if args.kind == "accounts":
+            write_account_list(f, args.accounts)
+        elif args.kind == "portfolio":
+            write_portfolio(f, args.accounts, args.positions, args.lots, args.noise, args.seed)
+        elif args.kind == "orders":
+            write_orders(f, args.orders, noise=args.noise, seed=args.seed)
+        else:
+            write_quotes(f, position_symbols(args.symbols, args.noise, args.seed))
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+if __name__ == "__main__":
+    main()
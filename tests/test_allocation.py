@@ -0,0 +1,130 @@
+import itertools
+import random
+import warnings
+import numpy as np
+import pytest
+from accounts.allocation import allocate, whole_shares
+
+
+def squared_drift(shares, targets, prices):
+    return sum((shares.get(symbol, 0) * prices[symbol] - target) ** 2 for symbol, target in targets.items())
+
+
+def brute_force_shares(targets, prices):
+    """Least squared drift over every share combination that fits the budget"""
+    symbols = list(targets)
+    budget = sum(targets.values())
+    ranges = [range(int(budget // prices[symbol]) + 1) for symbol in symbols]
+    return min(sum((count * prices[symbol] - targets[symbol]) ** 2 for count, symbol in zip(counts, symbols))
+               for counts in itertools.product(*ranges)
+               if sum(count * prices[symbol] for count, symbol in zip(counts, symbols)) <= budget + 1e-9)
+
+
+def random_case(rnd, size, low=5, high=120, most=300):
+    symbols = ["S{}".format(index) for index in range(size)]
+    return ({symbol: rnd.uniform(0, most) for symbol in symbols},
+            {symbol: round(rnd.uniform(low, high), 2) for symbol in symbols})
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_whole_shares_matches_brute_force(seed):
+    rnd = random.Random(seed)
+    targets, prices = random_case(rnd, rnd.randint(1, 3), most=250)
+    shares, leftover = whole_shares(targets, prices, spendLeftover=False)
+    assert squared_drift(shares, targets, prices) == pytest.approx(brute_force_shares(targets, prices), abs=1e-6)
+
+
+@pytest.mark.parametrize("spendLeftover", [False, True])
+@pytest.mark.parametrize("size", [1, 4, 40, 300])
+def test_whole_shares_never_exceeds_budget(size, spendLeftover):
+    rnd = random.Random(size)
+    for _ in range(20):
+        targets, prices = random_case(rnd, size, high=500, most=800)
+        shares, leftover = whole_shares(targets, prices, spendLeftover=spendLeftover)
+        cost = sum(count * prices[symbol] for symbol, count in shares.items())
+        assert all(isinstance(count, int) and count >= 0 for count in shares.values())
+        assert cost <= sum(targets.values()) + 1e-6
+        assert leftover == pytest.approx(sum(targets.values()) - cost, abs=1e-6)
+
+
+def test_whole_shares_spends_leftover_below_every_price():
+    rnd = random.Random(7)
+    for _ in range(50):
+        targets, prices = random_case(rnd, 6)
+        shares, leftover = whole_shares(targets, prices)
+        assert leftover < min(prices.values())
+
+
+def test_whole_shares_skips_zero_and_missing_prices():
+    targets = {"VTI": 1000.0, "BND": 500.0, "VEU": 300.0, "VWO": 200.0, "GONE": 100.0}
+    prices = {"VTI": 250.0, "BND": 0, "VEU": None, "VWO": -3.0}
+    shares, leftover = whole_shares(targets, prices)
+    # only VTI can be bought, the budget is the target of the symbols that have a price
+    assert shares == {"VTI": 4}
+    assert leftover == pytest.approx(0.0)
+
+
+def test_whole_shares_skips_zero_targets_and_handles_empty_input():
+    assert whole_shares({}, {}) == ({}, 0.0)
+    shares, leftover = whole_shares({"VTI": 0.0, "BND": 100.0}, {"VTI": 250.0, "BND": 70.0})
+    assert shares == {"BND": 1}
+    assert leftover == pytest.approx(30.0)
+
+
+def reference_allocation(values, targets, contribution, steps=20000):
+    """Hands out the contribution in small steps, each to the class furthest below its target"""
+    values = list(values)
+    amounts = [0.0] * len(values)
+    step = contribution / steps
+    for _ in range(steps):
+        index = min((index for index in range(len(values)) if targets[index] > 0),
+                    key=lambda index: values[index] / targets[index])
+        values[index] += step
+        amounts[index] += step
+    return amounts
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_allocate_matches_reference(seed):
+    rnd = random.Random(seed)
+    values = [rnd.uniform(0, 5000) for _ in range(3)]
+    targets = [0.2, 0.56, 0.24]
+    contribution = rnd.choice([100, 1000, 10000])
+    amounts = allocate(values, targets, contribution)
+    assert amounts.sum() == pytest.approx(contribution)
+    assert (amounts >= 0).all()
+    assert amounts == pytest.approx(reference_allocation(values, targets, contribution), abs=contribution * 1e-3)
+
+
+def test_allocate_reaches_targets_with_large_contribution():
+    values = [1000.0, 0.0, 500.0]
+    targets = [0.5, 0.3, 0.2]
+    amounts = allocate(values, targets, 100000)
+    final = np.asarray(values) + amounts
+    assert final / final.sum() == pytest.approx(targets)
+
+
+def test_allocate_gives_nothing_to_classes_without_target():
+    amounts = allocate([0.0, 100.0, 100.0], [0.0, 0.5, 0.5], 1000)
+    assert amounts[0] == 0
+    assert amounts.sum() == pytest.approx(1000)
+
+
+def test_allocate_accounts_at_once_match_single_accounts():
+    values = [[1000.0, 200.0, 300.0], [0.0, 0.0, 0.0], [50.0, 5000.0, 10.0]]
+    targets = [0.2, 0.56, 0.24]
+    batch = allocate(values, targets, [1000, 500, 250])
+    for row, contribution, expected in zip(values, [1000, 500, 250], batch):
+        assert allocate(row, targets, contribution) == pytest.approx(expected)
+
+
+def test_allocate_handles_no_classes():
+    assert allocate([], [], 1000).shape == (0,)
+    assert allocate(np.zeros((3, 0)), np.zeros(0), 1000).shape == (3, 0)
+
+
+def test_allocate_gives_nothing_without_any_target():
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        amounts = allocate([[100.0, 0.0], [0.0, 0.0]], [0.0, 0.0], 1000)
+    assert amounts.tolist() == [[0.0, 0.0], [0.0, 0.0]]
@@ -0,0 +1,72 @@
+import json
+import os
+import time
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+# access tokens expire at midnight US Eastern time and go inactive after two hours without requests
+ETRADE_TIMEZONE = ZoneInfo("America/New_York")
+IDLE_SECONDS = 2 * 60 * 60
+
+
+def load_token(path):
+    """
+    Reads a stored access token
+
+    :param path: token file
+    :return dict with access_token, access_token_secret, consumer_key, base_url, issued and last_used, or None
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_token(path, token):
+    """
+    Writes an access token to a file only the current user can read
+
+    :param path: token file
+    :param token: dict as returned by load_token
+    """
+    tmp_path = path + ".tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(token, f)
+    os.replace(tmp_path, path)
+
+
+def new_token(access_token, access_token_secret, consumer_key, base_url):
+    now = time.time()
+    return {"access_token": access_token,
+            "access_token_secret": access_token_secret,
+            "consumer_key": consumer_key,
+            "base_url": base_url,
+            "issued": now,
+            "last_used": now}
+
+
+def is_expired(token, now=None):
+    """
+    Returns True once the E*TRADE day the token was issued on has ended
+    """
+    now = time.time() if now is None else now
+    issued_day = datetime.fromtimestamp(token["issued"], ETRADE_TIMEZONE).date()
+    return datetime.fromtimestamp(now, ETRADE_TIMEZONE).date() != issued_day
+
+
+def is_idle(token, now=None):
+    """
+    Returns True if the token has gone unused long enough to need the renew access token call
+    """
+    now = time.time() if now is None else now
+    return now - token["last_used"] >= IDLE_SECONDS
+
+
+def touch(path, token):
+    """
+    Records that the token was just used
+    """
+    token["last_used"] = time.time()
+    save_token(path, token)
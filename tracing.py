@@ -0,0 +1,116 @@
+"""Nested timing spans and cProfile reports for the client workflows
+
+Set the ETRADE_TRACE environment variable to a file name to record the fetch, decode, classify, rebalance and
+render spans of a run; the file is written in Chrome trace format at exit and opens in chrome://tracing or
+https://ui.perfetto.dev. Without the variable spans cost a single check.
+"""
+import atexit
+import cProfile
+import io
+import json
+import multiprocessing
+import os
+import pstats
+import threading
+import time
+from contextlib import ContextDecorator, contextmanager
+
+_path = os.environ.get("ETRADE_TRACE")
+_events = [] if _path else None
+_threads = {}
+
+
+class Span(ContextDecorator):
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.start = None
+
+    def _recreate_cm(self):
+        # a decorated function gets a new span per call, so concurrent calls do not share the start time
+        return Span(self.name, self.args)
+
+    def __enter__(self):
+        if _events is not None:
+            self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        if self.start is not None and _events is not None:
+            end = time.perf_counter_ns()
+            tid = threading.get_ident()
+            if tid not in _threads:
+                _threads[tid] = threading.current_thread().name
+            _events.append({"name": self.name, "cat": self.name, "ph": "X", "pid": os.getpid(), "tid": tid,
+                            "ts": self.start / 1000, "dur": (end - self.start) / 1000, "args": self.args})
+        return False
+
+
+def span(name, **args):
+    """
+    Times the enclosed block, or every call when used as a decorator
+
+    :param name: phase of the span: fetch, decode, classify, rebalance, render or a workflow name
+    :param args: details shown with the span in the trace viewer
+    """
+    return Span(name, args)
+
+
+def enabled():
+    return _events is not None
+
+
+def start(path):
+    """
+    Starts recording spans, to be written to path at exit
+    """
+    global _path, _events
+    if _events is None:
+        _events = []
+        atexit.register(dump)
+    _path = path
+
+
+def dump(path=None):
+    """
+    Writes the recorded spans as a Chrome trace JSON file
+    """
+    path = path or _path
+    if _events is None or not path:
+        return
+    if path == _path and multiprocessing.parent_process() is not None:
+        # worker processes inherit ETRADE_TRACE, each one writes its own file next to the coordinator's
+        root, ext = os.path.splitext(path)
+        path = "{}.{}{}".format(root, os.getpid(), ext)
+    metadata = [{"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tid, "args": {"name": name}}
+                for tid, name in list(_threads.items())]
+    with open(path, "w") as f:
+        json.dump({"traceEvents": metadata + list(_events), "displayTimeUnit": "ms"}, f)
+
+
+@contextmanager
+def profiled(path, sort="cumulative", limit=60):
+    """
+    Runs the enclosed block under cProfile and writes the stats sorted by sort to path
+
+    :param path: report file, profiling is skipped if None
+    """
+    if path is None:
+        yield
+        return
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield
+    finally:
+        profile.disable()
+        report = io.StringIO()
+        pstats.Stats(profile, stream=report).strip_dirs().sort_stats(sort).print_stats(limit)
+        with open(path, "w") as f:
+            f.write(report.getvalue())
+        profile.dump_stats(os.path.splitext(path)[0] + ".prof")
+        print("Profile written to " + path)
+
+
+if _events is not None:
+    atexit.register(dump)
@@ -0,0 +1,406 @@
+"""Pluggable transports mounted under the OAuth session
+
+Every adapter wraps the next one, so recording, replaying and later layers can be stacked without the
+Accounts, Order and Market classes knowing about them.
+"""
+import hashlib
+import json
+import os
+import re
+import socket
+import threading
+import time
+from urllib.parse import urlsplit, parse_qsl, urlencode
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib3.connection import HTTPConnection
+from rauth.session import OAUTH1_DEFAULT_TIMEOUT
+import metrics
+import rate_limit
+import tracing
+
+LIVE = "live"
+RECORD = "record"
+REPLAY = "replay"
+
+# (connect, read) timeouts in seconds per endpoint class, see rate_limit.endpoint_class
+DEFAULT_TIMEOUTS = {rate_limit.ORDERS: (5.0, 60.0),
+                    rate_limit.ACCOUNTS: (5.0, 30.0),
+                    rate_limit.MARKET: (5.0, 10.0),
+                    rate_limit.OTHER: (5.0, 30.0)}
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    __attrs__ = HTTPAdapter.__attrs__ + ["timeouts"]
+
+    def __init__(self, poolSize=10, hosts=4, timeouts=None):
+        """
+        Sends requests over persistent connections, applying a timeout per endpoint class
+
+        :param poolSize: connections kept open per host, at least the number of threads sending requests
+        :param hosts: number of hosts whose pools are kept
+        :param timeouts: dict of endpoint class -> (connect, read) seconds, used when the caller sets none
+        """
+        self.timeouts = dict(DEFAULT_TIMEOUTS, **(timeouts or {}))
+        super().__init__(pool_connections=hosts, pool_maxsize=poolSize)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        # TCP keep-alive stops idle pooled connections from being dropped silently between menu actions
+        pool_kwargs.setdefault("socket_options",
+                               HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)])
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+
+    def send(self, request, **kwargs):
+        # rauth sends every request with its 300 second default, which is replaced like no timeout at all
+        if kwargs.get("timeout") in (None, OAUTH1_DEFAULT_TIMEOUT):
+            kwargs["timeout"] = self.timeouts.get(rate_limit.endpoint_class(urlsplit(request.url).path),
+                                                  self.timeouts[rate_limit.OTHER])
+        return super().send(request, **kwargs)
+
+    def stats(self):
+        """
+        :return dict of requests sent, connections opened and the share of requests that reused a connection
+        """
+        requests = connections = 0
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                requests += pool.num_requests
+                connections += pool.num_connections
+        return {"requests": requests, "connections": connections,
+                "reuse": 1 - connections / requests if requests else 0.0}
+
+
+def parse_timeouts(value):
+    """
+    Parses "market=3/10,orders=5/60" into a dict of endpoint class -> (connect, read) seconds
+    """
+    timeouts = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            name, pair = item.split("=", 1)
+            connect, _, read = pair.partition("/")
+            timeouts[name.strip().lower()] = (float(connect), float(read or connect))
+    return timeouts
+
+
+# worker settings of every pool sending requests through the session, with their defaults
+POOL_WORKERS = {"ORDER_FETCH_WORKERS": 6, "QUOTE_FETCH_WORKERS": 4, "BATCH_WORKERS": 8, "ORDER_PIPELINE_WORKERS": 6,
+                "PREFETCH_WORKERS": 4, "ASYNC_CONCURRENCY": 8}
+
+
+def pool_size(settings):
+    """
+    Connections per host, enough for the largest pool sending requests and at least 10, unless HTTP_POOL_SIZE is set
+    """
+    if settings.get("HTTP_POOL_SIZE"):
+        return int(settings["HTTP_POOL_SIZE"])
+    return max([int(settings.get(name, default)) for name, default in POOL_WORKERS.items()] + [10])
+
+
+class TransportAdapter(HTTPAdapter):
+    """Base of the adapters layered under the session, delegates every request to the inner adapter"""
+
+    def __init__(self, inner=None):
+        super().__init__()
+        self.inner = inner if inner is not None else HTTPAdapter()
+
+    def send(self, request, **kwargs):
+        return self.inner.send(request, **kwargs)
+
+    def close(self):
+        self.inner.close()
+        super().close()
+
+
+def cassette_key(request):
+    """
+    Identifies a request by method, path, query and body, leaving out the OAuth parameters that change every call
+    """
+    url = urlsplit(request.url)
+    query = sorted((name, value) for name, value in parse_qsl(url.query) if not name.startswith("oauth_"))
+    body = request.body or ""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", "replace")
+    return "{} {}?{} {}".format(request.method, url.path, urlencode(query), body.strip())
+
+
+def cassette_path(cassetteDir, key):
+    return os.path.join(cassetteDir, hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + ".json")
+
+
+def build_response(request, status, headers, body):
+    response = requests.Response()
+    response.status_code = status
+    response.headers = CaseInsensitiveDict(headers)
+    response._content = body.encode("utf-8") if isinstance(body, str) else body
+    response.encoding = "utf-8"
+    response.url = request.url
+    response.request = request
+    response.reason = "Replayed"
+    return response
+
+
+class RecordingAdapter(TransportAdapter):
+    def __init__(self, cassetteDir, inner=None):
+        """
+        Sends requests over the network and saves every request/response pair into a cassette file
+
+        :param cassetteDir: directory of the cassette files
+        :param inner: adapter that performs the request
+        """
+        super().__init__(inner)
+        self.cassetteDir = cassetteDir
+        os.makedirs(cassetteDir, exist_ok=True)
+
+    def send(self, request, **kwargs):
+        response = self.inner.send(request, **kwargs)
+        key = cassette_key(request)
+        cassette = {"key": key,
+                    "status": response.status_code,
+                    "headers": {"Content-Type": response.headers.get("Content-Type", "application/json")},
+                    "body": response.content.decode("utf-8", "replace")}
+        with open(cassette_path(self.cassetteDir, key), "w") as f:
+            json.dump(cassette, f, indent=2)
+        return response
+
+
+class ReplayAdapter(TransportAdapter):
+    def __init__(self, cassetteDir, latency=0.0, fallbacks=None):
+        """
+        Answers requests from cassette files without any network access
+
+        :param cassetteDir: directory of the cassette files
+        :param latency: seconds to wait before answering, to mimic the round trip
+        :param fallbacks: dict of URL path regex -> JSON file served when no cassette matches
+        """
+        super().__init__()
+        self.cassetteDir = cassetteDir
+        self.latency = latency
+        self.fallbacks = [(re.compile(pattern), path) for pattern, path in (fallbacks or {}).items()]
+
+    def send(self, request, **kwargs):
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        key = cassette_key(request)
+        path = cassette_path(self.cassetteDir, key)
+        if os.path.exists(path):
+            with open(path) as f:
+                cassette = json.load(f)
+            return build_response(request, cassette["status"], cassette["headers"], cassette["body"])
+
+        urlPath = urlsplit(request.url).path
+        for pattern, fallbackPath in self.fallbacks:
+            if pattern.search(urlPath):
+                with open(fallbackPath, "rb") as f:
+                    return build_response(request, 200, {"Content-Type": "application/json"}, f.read())
+
+        body = json.dumps({"Error": {"message": "No recorded response for " + key}})
+        return build_response(request, 404, {"Content-Type": "application/json"}, body)
+
+
+class MetricsAdapter(TransportAdapter):
+    def __init__(self, inner=None, registry=None):
+        """
+        Records the latency, size and outcome of every request in the metrics registry
+
+        :param inner: adapter that performs the request
+        :param registry: metrics.Metrics instance, the shared registry by default
+        """
+        super().__init__(inner)
+        self.registry = registry if registry is not None else metrics.REGISTRY
+
+    def send(self, request, **kwargs):
+        path = urlsplit(request.url).path
+        start = time.perf_counter()
+        try:
+            response = self.inner.send(request, **kwargs)
+        except Exception:
+            self.registry.observe_request(request.method, path, time.perf_counter() - start, error=True)
+            raise
+        elapsed = time.perf_counter() - start
+        # streamed bodies are not read here, their size is only known from the header
+        length = response.headers.get("Content-Length")
+        if length is not None and length.isdigit():
+            nbytes = int(length)
+        else:
+            nbytes = 0 if kwargs.get("stream") else len(response.content or b"")
+        self.registry.observe_request(request.method, path, elapsed, nbytes, response.status_code >= 400)
+        return response
+
+
+class TracingAdapter(TransportAdapter):
+    """Records a fetch span around every request, see tracing.py"""
+
+    def send(self, request, **kwargs):
+        with tracing.span("fetch", method=request.method,
+                          endpoint=metrics.endpoint_template(urlsplit(request.url).path)):
+            return self.inner.send(request, **kwargs)
+
+
+class RateLimitAdapter(TransportAdapter):
+    def __init__(self, scheduler, inner=None, registry=None):
+        """
+        Holds every request until the scheduler grants it a token of its endpoint class
+
+        :param scheduler: rate_limit.RequestScheduler shared by the session
+        :param inner: adapter that performs the request
+        :param registry: metrics.Metrics instance receiving the time spent waiting, the shared registry by default
+        """
+        super().__init__(inner)
+        self.scheduler = scheduler
+        self.registry = registry if registry is not None else metrics.REGISTRY
+
+    def send(self, request, **kwargs):
+        name = rate_limit.endpoint_class(urlsplit(request.url).path)
+        self.registry.observe_phase("throttle", name, self.scheduler.acquire(name))
+        response = self.inner.send(request, **kwargs)
+        if response.status_code == 429:
+            # the server counts differently than we do, back off before the next request of the class
+            retryAfter = response.headers.get("Retry-After", "")
+            self.scheduler.penalize(name, float(retryAfter) if retryAfter.isdigit() else 1.0)
+        return response
+
+
+class InFlightCall:
+    __slots__ = ("done", "response", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None
+        self.error = None
+
+
+class SingleFlightAdapter(TransportAdapter):
+    def __init__(self, inner=None, registry=None):
+        """
+        Lets concurrent identical GET requests share one network call
+
+        The first request of a key goes out, the others wait for it and receive the same response object, so
+        the body is parsed only once by decode(). The parsed body is then shared by every caller and must be
+        treated as read-only; callers that need to change it work on a copy.
+
+        :param inner: adapter that performs the request
+        :param registry: metrics.Metrics instance counting the collapsed calls, the shared registry by default
+        """
+        super().__init__(inner)
+        self.registry = registry if registry is not None else metrics.REGISTRY
+        self.lock = threading.Lock()
+        self.inflight = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    def send(self, request, **kwargs):
+        if request.method != "GET" or kwargs.get("stream"):
+            return self.inner.send(request, **kwargs)
+
+        key = cassette_key(request)
+        with self.lock:
+            self.calls += 1
+            call = self.inflight.get(key)
+            leader = call is None
+            if leader:
+                call = self.inflight[key] = InFlightCall()
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            self.registry.increment("singleflight_collapsed", urlsplit(request.url).path)
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.response
+
+        try:
+            response = self.inner.send(request, **kwargs)
+            # the body is read before sharing, so waiting threads never read the connection concurrently
+            response.content
+            call.response = response
+            return response
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[key]
+            call.done.set()
+
+    def stats(self):
+        """
+        :return dict of GET requests seen and requests answered by another in-flight call
+        """
+        with self.lock:
+            return {"calls": self.calls, "collapsed": self.collapsed}
+
+
+def install(session, adapter):
+    """
+    Routes every request of the session through the adapter
+    """
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configure_session(session, settings, devMode=False):
+    """
+    Mounts the transport stack selected in config.ini under the session, from the top:
+
+    - SingleFlightAdapter merging concurrent identical GETs, unless SINGLE_FLIGHT = off
+    - RateLimitAdapter keeping requests within RATE_LIMITS and RATE_LIMIT_TOTAL, unless replaying
+    - MetricsAdapter measuring every request
+    - the TRANSPORT: live (default), record or replay, live and record over a PooledHTTPAdapter sized by
+      HTTP_POOL_SIZE with the HTTP_TIMEOUTS per endpoint class
+
+    devMode replays cassettes and serves fakeData.json for any portfolio request that was not recorded.
+
+    :param session: session created by the OAuth service
+    :param settings: config section providing the optional keys above and CASSETTE_DIR and REPLAY_LATENCY_MS
+    :param devMode: replay offline regardless of TRANSPORT
+    :return the session
+    """
+    mode = REPLAY if devMode else settings.get("TRANSPORT", LIVE).lower()
+    cassetteDir = settings.get("CASSETTE_DIR", "cassettes")
+    if mode == REPLAY:
+        fallbacks = {r"/portfolio\.json$": "fakeData.json"} if devMode else None
+        latency = float(settings.get("REPLAY_LATENCY_MS", 0)) / 1000
+        adapter = ReplayAdapter(cassetteDir, latency, fallbacks)
+    else:
+        adapter = PooledHTTPAdapter(pool_size(settings), timeouts=parse_timeouts(settings.get("HTTP_TIMEOUTS")))
+        pooled = adapter
+        metrics.REGISTRY.add_gauge("http_requests_sent", "Requests sent over pooled connections",
+                                   lambda: pooled.stats()["requests"])
+        metrics.REGISTRY.add_gauge("http_connections_opened", "Connections opened, each one a TCP and TLS handshake",
+                                   lambda: pooled.stats()["connections"])
+        if mode == RECORD:
+            adapter = RecordingAdapter(cassetteDir, adapter)
+    if tracing.enabled():
+        adapter = TracingAdapter(adapter)
+    adapter = MetricsAdapter(adapter)
+    limits = settings.get("RATE_LIMITS", "")
+    if mode != REPLAY and limits.lower() != "off":
+        total = float(settings.get("RATE_LIMIT_TOTAL", 0)) or None
+        adapter = RateLimitAdapter(rate_limit.RequestScheduler(rate_limit.parse_budgets(limits), total), adapter)
+    if settings.get("SINGLE_FLIGHT", "on").lower() != "off":
+        adapter = SingleFlightAdapter(adapter)
+    install(session, adapter)
+    return session
+
+
+def connection_stats(session):
+    """
+    Returns the connection reuse statistics of the session, see PooledHTTPAdapter.stats, or None when replaying
+    """
+    adapter = session.get_adapter("https://")
+    while adapter is not None:
+        if isinstance(adapter, PooledHTTPAdapter):
+            return adapter.stats()
+        adapter = getattr(adapter, "inner", None)
+    return None
+
+
+def is_offline(settings, devMode=False):
+    return devMode or settings.get("TRANSPORT", LIVE).lower() == REPLAY